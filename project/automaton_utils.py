@@ -1,12 +1,22 @@
+from collections import defaultdict, namedtuple, OrderedDict
+from itertools import islice
 from networkx import MultiDiGraph
+from pyformlang.cfg import CFG
 from pyformlang.regular_expression import Regex
 from pyformlang.finite_automaton import (
     EpsilonNFA as ENFA,
     DeterministicFiniteAutomaton as DFA,
     NondeterministicFiniteAutomaton as NFA,
 )
-from typing import Set, Union
-from scipy.sparse import dok_matrix
+from typing import Iterator, List, Set, Tuple, Union
+import numpy as np
+from scipy.sparse import csr_matrix, identity, kron
+import project.cfg_utils as cfg_utils
+import project.matrix_backend as matrix_backend
+import project.parallel_utils as parallel_utils
+import project.profiling as profiling
+from project.rpq_result import RpqResult
+import project.rsm_utils as rsm_utils
 import project.sparse_matrix_utils as sparse_matrix_utils
 
 
@@ -14,6 +24,73 @@ def regex_to_min_dfa(r: Regex) -> DFA:
     return r.to_epsilon_nfa().minimize()
 
 
+CompiledRegex = namedtuple("CompiledRegex", ["dfa", "sparse_matrix"])
+
+
+class RegexCache:
+    # LRU cache of minimized DFAs and their boolean decompositions keyed by
+    # the regex text and the matrix backend the decomposition was built in.
+    # Cached values are shared, so callers must not mutate them.
+    def __init__(self, maxsize: int = 256) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        return
+
+    def get(self, regex: Union[str, Regex]) -> CompiledRegex:
+        key = (
+            matrix_backend.get_backend().name,
+            regex if isinstance(regex, str) else str(regex),
+        )
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        self.misses += 1
+        with profiling.phase("regex_to_min_dfa"):
+            dfa = regex_to_min_dfa(Regex(regex) if isinstance(regex, str) else regex)
+        with profiling.phase("nfa_to_sparse_matrix") as timer:
+            compiled = CompiledRegex(dfa, sparse_matrix_utils.nfa_to_sparse_matrix(dfa))
+            timer.output(compiled.sparse_matrix.matrix)
+        if self.maxsize > 0:
+            self._entries[key] = compiled
+            self._shrink()
+        return compiled
+
+    def resize(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._shrink()
+        return
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+        return
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+    def _shrink(self) -> None:
+        while len(self._entries) > max(self.maxsize, 0):
+            self._entries.popitem(last=False)
+        return
+
+
+regex_cache = RegexCache()
+
+
+def compile_regex(regex: Union[str, Regex]) -> CompiledRegex:
+    return regex_cache.get(regex)
+
+
 def graph_to_nfa(
     graph: MultiDiGraph,
     start_nodes: Set[int] = None,
@@ -42,79 +119,537 @@ def graph_to_nfa(
     return automaton
 
 
-def rpq(
+def graph_to_sparse_matrix(
+    graph: MultiDiGraph,
+    start_nodes: Set[int] = None,
+    final_nodes: Set[int] = None,
+    labels: set = None,
+) -> sparse_matrix_utils.SparseMatrix:
+    # Same decomposition as nfa_to_sparse_matrix(graph_to_nfa(...)),
+    # but without building the intermediate automaton. With labels set,
+    # edges with other labels are skipped.
+    with profiling.phase("graph_to_matrix") as timer:
+        numerated_states = {node: i for i, node in enumerate(graph.nodes)}
+        inversed_numerated_states = dict(enumerate(graph.nodes))
+
+        symbol_ids = dict()
+        rows, cols, label_ids = [], [], []
+        for node_from, node_to, label in graph.edges(data="label"):
+            if label is None or (labels is not None and label not in labels):
+                continue
+            rows.append(numerated_states[node_from])
+            cols.append(numerated_states[node_to])
+            label_ids.append(symbol_ids.setdefault(label, len(symbol_ids)))
+
+        matrix = sparse_matrix_utils.coo_to_bool_matrices(
+            np.array(rows, dtype=np.int64),
+            np.array(cols, dtype=np.int64),
+            np.array(label_ids, dtype=np.int64),
+            list(symbol_ids.keys()),
+            len(numerated_states),
+        )
+        timer.output(matrix)
+
+    if start_nodes is None:
+        start_nodes = graph.nodes
+    if final_nodes is None:
+        final_nodes = graph.nodes
+
+    return sparse_matrix_utils.SparseMatrix(
+        numerated_states,
+        inversed_numerated_states,
+        {node for node in start_nodes if node in numerated_states},
+        {node for node in final_nodes if node in numerated_states},
+        matrix,
+    )
+
+
+def plan_graph_matrix(
     graph: MultiDiGraph,
-    regex: Regex,
+    regex_smatrix: sparse_matrix_utils.SparseMatrix,
     start_states: set = None,
     final_states: set = None,
-) -> set:
-    rpq = set()
-    matrix_from_graph = sparse_matrix_utils.nfa_to_sparse_matrix(
-        graph_to_nfa(graph, start_states, final_states)
+) -> sparse_matrix_utils.SparseMatrix:
+    # Decomposes only the labels of the regex alphabet, then drops the
+    # vertices that lie on no path from a start to a final vertex under them.
+    labels = {getattr(symbol, "value", symbol) for symbol in regex_smatrix.matrix}
+    graph_smatrix = graph_to_sparse_matrix(graph, start_states, final_states, labels)
+    with profiling.phase("prune") as timer:
+        graph_smatrix = sparse_matrix_utils.prune_states(graph_smatrix)
+        timer.output(graph_smatrix.matrix)
+    return graph_smatrix
+
+
+def _as_result(sparse_matrix, answers, pairs: bool) -> RpqResult:
+    return RpqResult.from_answers(
+        sparse_matrix.inversed_numerated_states,
+        sparse_matrix.numerated_states,
+        answers,
+        pairs,
     )
-    matrix_from_regex = sparse_matrix_utils.nfa_to_sparse_matrix(
-        regex_to_min_dfa(regex)
+
+
+def rpq(
+    graph: MultiDiGraph,
+    regex: Union[str, Regex],
+    start_states: set = None,
+    final_states: set = None,
+    lazy_product: bool = False,
+    packed_regex: bool = False,
+    exists: bool = False,
+    limit: int = None,
+    lazy_result: bool = False,
+) -> Union[set, bool, RpqResult]:
+    # exists and limit switch to the lazy product traversal, which stops as
+    # soon as enough accepting pairs have been reached. lazy_result returns
+    # an RpqResult, which maps matrix indices to vertices only on access.
+    matrix_from_regex = compile_regex(regex).sparse_matrix
+    matrix_from_graph = plan_graph_matrix(
+        graph, matrix_from_regex, start_states, final_states
     )
-    matrix_from_regex_states_count = len(matrix_from_regex.numerated_states)
-    intersection_matrix = sparse_matrix_utils.intersect(
-        matrix_from_graph, matrix_from_regex
+    if packed_regex or matrix_backend.get_backend().pack_regex:
+        matrix_from_regex = sparse_matrix_utils.pack_sparse_matrix(matrix_from_regex)
+    if exists:
+        return bool(
+            sparse_matrix_utils.product_bfs(
+                matrix_from_graph, matrix_from_regex, foreach_start_node=True, limit=1
+            )
+        )
+    if lazy_product or limit is not None:
+        ans = sparse_matrix_utils.product_bfs(
+            matrix_from_graph,
+            matrix_from_regex,
+            foreach_start_node=True,
+            limit=limit,
+        )
+        return _as_result(matrix_from_graph, ans, True) if lazy_result else ans
+
+    compact_graph = sparse_matrix_utils.to_compact(matrix_from_graph)
+    intersection = sparse_matrix_utils.compact_intersect(
+        compact_graph, sparse_matrix_utils.to_compact(matrix_from_regex)
     )
+    if not intersection.matrix:
+        return _as_result(matrix_from_graph, (), True) if lazy_result else set()
 
-    if not intersection_matrix.matrix.values():
-        matrix = dok_matrix((1, 1))
-    else:
-        matrix = sum(intersection_matrix.matrix.values())
-        prev_nonzeros = matrix.count_nonzero()
-        curr_nonzeros = 0
-
-        while prev_nonzeros != curr_nonzeros:
-            matrix += matrix @ matrix
-            prev_nonzeros = curr_nonzeros
-            curr_nonzeros = matrix.count_nonzero()
-
-    for state_from, state_to in zip(*matrix.nonzero()):
-        if (
-            state_from in intersection_matrix.start_states
-            and state_to in intersection_matrix.final_states
-        ):
-            rpq.add(
-                (
-                    state_from // matrix_from_regex_states_count,
-                    state_to // matrix_from_regex_states_count,
-                )
-            )
+    matrix = sparse_matrix_utils.transitive_closure(sum(intersection.matrix.values()))
+    with profiling.phase("decode"):
+        states_from, states_to = matrix.nonzero()
+        accepted = (
+            intersection.start_mask[states_from] & intersection.final_mask[states_to]
+        )
+        regex_states_count = len(matrix_from_regex.numerated_states)
+        graph_states_from, _ = sparse_matrix_utils.split_product_states(
+            states_from[accepted], regex_states_count
+        )
+        graph_states_to, _ = sparse_matrix_utils.split_product_states(
+            states_to[accepted], regex_states_count
+        )
 
-    rpq_result = set()
-    for state1, state2 in rpq:
-        rpq_result.add(
-            (
-                matrix_from_graph.inversed_numerated_states[state1],
-                matrix_from_graph.inversed_numerated_states[state2],
+        if lazy_result:
+            return RpqResult(
+                matrix_from_graph.inversed_numerated_states,
+                matrix_from_graph.numerated_states,
+                graph_states_to,
+                graph_states_from,
+            )
+        return set(
+            zip(
+                compact_graph.states[graph_states_from].tolist(),
+                compact_graph.states[graph_states_to].tolist(),
             )
         )
 
-    return rpq_result
+
+def rpq_batch(
+    graph: MultiDiGraph,
+    regexes: List[Union[str, Regex]],
+    start_states: set = None,
+    final_states: set = None,
+) -> List[set]:
+    # Answers every query with one traversal: the graph is decomposed once and
+    # the query DFAs are merged into one automaton whose states are tagged
+    # with the queries accepting in them.
+    ans = [set() for _ in regexes]
+    if not regexes:
+        return ans
+
+    union, tags = sparse_matrix_utils.tagged_union(
+        [compile_regex(regex).sparse_matrix for regex in regexes]
+    )
+    matrix_from_graph = plan_graph_matrix(graph, union, start_states, final_states)
+    if not matrix_from_graph.start_states:
+        return ans
+    numerated_start_states = [
+        matrix_from_graph.numerated_states[s] for s in matrix_from_graph.start_states
+    ]
+    visited = sparse_matrix_utils.product_reachability(
+        matrix_from_graph, union, numerated_start_states
+    )
+    final_mask = np.zeros(len(matrix_from_graph.numerated_states), dtype=bool)
+    for state in matrix_from_graph.final_states:
+        final_mask[matrix_from_graph.numerated_states[state]] = True
+
+    for state, reached in visited.items():
+        if state not in tags:
+            continue
+        rows, cols = reached.nonzero()
+        accepted = final_mask[cols]
+        pairs = {
+            (
+                matrix_from_graph.inversed_numerated_states[numerated_start_states[i]],
+                matrix_from_graph.inversed_numerated_states[j],
+            )
+            for i, j in zip(rows[accepted], cols[accepted])
+        }
+        for query in tags[state]:
+            ans[query] |= pairs
+    return ans
 
 
 def bfs_rpq(
     graph: MultiDiGraph,
-    regex: Regex,
+    regex: Union[str, Regex],
     start_states: set = None,
     final_states: set = None,
     foreach_start_node: bool = False,
-) -> set:
-    if (
-        regex_to_min_dfa(regex).is_empty()
-        or {}
-        == sparse_matrix_utils.nfa_to_sparse_matrix(regex_to_min_dfa(regex)).matrix
-    ):
-        if start_states:
-            return start_states
-        return graph.nodes
-    return sparse_matrix_utils.bfs(
-        sparse_matrix_utils.nfa_to_sparse_matrix(
-            graph_to_nfa(graph, start_states, final_states)
-        ),
-        sparse_matrix_utils.nfa_to_sparse_matrix(regex_to_min_dfa(regex)),
+    executor: str = "serial",
+    workers: int = None,
+    packed_regex: bool = False,
+    exists: bool = False,
+    limit: int = None,
+    lazy_result: bool = False,
+    direction: str = "auto",
+    return_plan: bool = False,
+) -> Union[set, bool, RpqResult, Tuple]:
+    # direction is one of sparse_matrix_utils.DIRECTIONS or "auto", which
+    # takes the cheapest one by plan_direction for serial runs. Only forward
+    # evaluation is split between executors or stops early for exists and
+    # limit. With return_plan set, a pair of the answer and the QueryPlan
+    # that produced it is returned.
+    if direction != "auto" and direction not in sparse_matrix_utils.DIRECTIONS:
+        raise ValueError(
+            f"Unknown direction {direction}, expected one of "
+            f"{('auto',) + sparse_matrix_utils.DIRECTIONS}"
+        )
+    if exists:
+        limit = 1
+    plan = sparse_matrix_utils.QueryPlan("forward", {})
+    compiled_regex = compile_regex(regex)
+    if compiled_regex.dfa.is_empty() or {} == compiled_regex.sparse_matrix.matrix:
+        ans = start_states if start_states else graph.nodes
+        if limit is not None:
+            ans = set(islice(ans, limit))
+        if lazy_result and not exists:
+            ans = _as_result(graph_to_sparse_matrix(graph), ans, False)
+    else:
+        matrix_from_regex = compiled_regex.sparse_matrix
+        if packed_regex or matrix_backend.get_backend().pack_regex:
+            matrix_from_regex = sparse_matrix_utils.pack_sparse_matrix(
+                matrix_from_regex
+            )
+        matrix_from_graph = plan_graph_matrix(
+            graph, matrix_from_regex, start_states, final_states
+        )
+        if limit is not None:
+            ans = sparse_matrix_utils.product_bfs(
+                matrix_from_graph,
+                matrix_from_regex,
+                foreach_start_node,
+                limit,
+            )
+            if lazy_result and not exists:
+                ans = _as_result(matrix_from_graph, ans, foreach_start_node)
+        else:
+            if direction == "auto" and executor == "serial":
+                plan = sparse_matrix_utils.plan_direction(
+                    matrix_from_graph, matrix_from_regex, foreach_start_node
+                )
+            elif direction != "auto":
+                plan = sparse_matrix_utils.QueryPlan(direction, {})
+            ans = _run_plan(
+                plan,
+                matrix_from_graph,
+                matrix_from_regex,
+                foreach_start_node,
+                executor,
+                workers,
+                lazy_result,
+            )
+    if exists:
+        ans = bool(ans)
+    return (ans, plan) if return_plan else ans
+
+
+def _run_plan(
+    plan,
+    matrix_from_graph,
+    matrix_from_regex,
+    foreach_start_node: bool,
+    executor: str,
+    workers: int,
+    lazy_result: bool,
+) -> Union[set, RpqResult]:
+    if plan.direction == "reverse":
+        return sparse_matrix_utils.reverse_bfs(
+            matrix_from_graph, matrix_from_regex, foreach_start_node, lazy_result
+        )
+    if plan.direction == "bidirectional":
+        return sparse_matrix_utils.bidirectional_bfs(
+            matrix_from_graph, matrix_from_regex, foreach_start_node, lazy_result
+        )
+    return parallel_utils.parallel_bfs(
+        matrix_from_graph,
+        matrix_from_regex,
         foreach_start_node,
+        executor,
+        workers,
+        lazy_result,
+    )
+
+
+def bfs_rpq_batches(
+    graph: MultiDiGraph,
+    regex: Union[str, Regex],
+    start_states: set = None,
+    final_states: set = None,
+    chunk_size: int = 1024,
+) -> Iterator[Tuple]:
+    matrix_from_regex = compile_regex(regex).sparse_matrix
+    return sparse_matrix_utils.bfs_batches(
+        plan_graph_matrix(graph, matrix_from_regex, start_states, final_states),
+        matrix_from_regex,
+        chunk_size,
+    )
+
+
+def _cfpq_triples(graph_smatrix, matrices: dict) -> Set[Tuple]:
+    vertices = graph_smatrix.inversed_numerated_states
+    return {
+        (vertices[i], variable.value, vertices[j])
+        for variable, matrix in matrices.items()
+        for i, j in zip(*matrix.nonzero())
+    }
+
+
+def matrix_cfpq(
+    graph: MultiDiGraph, cfg: Union[str, CFG], start_symbol: str = "S"
+) -> Set[Tuple]:
+    # All (u, N, v) such that some path from u to v spells a word derivable
+    # from N. The grammar is taken to weak CNF, every nonterminal gets a
+    # |V| x |V| matrix and A -> B C is evaluated semi-naively: an iteration
+    # multiplies only the pairs found by the previous one, as
+    # delta(B) @ C + B @ delta(C).
+    wcnf = cfg_utils.cfg_to_wcnf(cfg, start_symbol)
+    graph_smatrix = graph_to_sparse_matrix(graph)
+    size = len(graph_smatrix.numerated_states)
+    matrices = {
+        variable: csr_matrix((size, size), dtype=bool) for variable in wcnf.variables
+    }
+
+    binary_productions = []
+    for production in wcnf.productions:
+        head, body = production.head, production.body
+        if len(body) == 0:
+            matrices[head] = matrices[head] + identity(size, dtype=bool, format="csr")
+        elif len(body) == 1:
+            if body[0].value in graph_smatrix.matrix:
+                matrices[head] = matrices[head] + csr_matrix(
+                    graph_smatrix.matrix[body[0].value], dtype=bool
+                )
+        else:
+            binary_productions.append((head, body[0], body[1]))
+
+    delta = dict(matrices)
+    while delta:
+        reached = dict()
+        for head, left, right in binary_productions:
+            for product in (
+                delta[left] @ matrices[right] if left in delta else None,
+                matrices[left] @ delta[right] if right in delta else None,
+            ):
+                if product is not None and product.nnz > 0:
+                    reached[head] = (
+                        reached[head] + product if head in reached else product
+                    )
+
+        delta = dict()
+        for head, product in reached.items():
+            new = product > matrices[head]
+            if new.nnz > 0:
+                matrices[head] = matrices[head] + new
+                delta[head] = new
+    return _cfpq_triples(graph_smatrix, matrices)
+
+
+def hellings_cfpq(
+    graph: MultiDiGraph, cfg: Union[str, CFG], start_symbol: str = "S"
+) -> Set[Tuple]:
+    # Worklist evaluation of the weak CNF grammar of matrix_cfpq. Facts are
+    # indexed by vertex and nonterminal in both directions, so a fact (u, N, v)
+    # is joined only with facts leaving v (for A -> N C) and facts entering u
+    # (for A -> B N) instead of scanning the whole result.
+    wcnf = cfg_utils.cfg_to_wcnf(cfg, start_symbol)
+    epsilon_heads = set()
+    terminal_heads = defaultdict(set)
+    by_left = defaultdict(list)
+    by_right = defaultdict(list)
+    for production in wcnf.productions:
+        head, body = production.head.value, production.body
+        if len(body) == 0:
+            epsilon_heads.add(head)
+        elif len(body) == 1:
+            terminal_heads[body[0].value].add(head)
+        else:
+            by_left[body[0].value].append((head, body[1].value))
+            by_right[body[1].value].append((head, body[0].value))
+
+    ans = set()
+    outgoing = defaultdict(lambda: defaultdict(set))
+    incoming = defaultdict(lambda: defaultdict(set))
+    worklist = []
+
+    def add(node_from, nonterminal, node_to) -> None:
+        fact = (node_from, nonterminal, node_to)
+        if fact in ans:
+            return
+        ans.add(fact)
+        outgoing[node_from][nonterminal].add(node_to)
+        incoming[node_to][nonterminal].add(node_from)
+        worklist.append(fact)
+        return
+
+    for node in graph.nodes:
+        for head in epsilon_heads:
+            add(node, head, node)
+    for node_from, node_to, label in graph.edges(data="label"):
+        for head in terminal_heads.get(label, ()):
+            add(node_from, head, node_to)
+
+    while worklist:
+        node_from, nonterminal, node_to = worklist.pop()
+        for head, right in by_left.get(nonterminal, ()):
+            for node in list(outgoing[node_to][right]):
+                add(node_from, head, node)
+        for head, left in by_right.get(nonterminal, ()):
+            for node in list(incoming[node_from][left]):
+                add(node, head, node_to)
+    return ans
+
+
+def tensor_cfpq(
+    graph: MultiDiGraph,
+    grammar: Union[str, CFG, rsm_utils.ECFG, rsm_utils.RSM],
+    start_symbol: str = "S",
+) -> Set[Tuple]:
+    # Same triples as matrix_cfpq, found through the RSM: the closure of
+    # kron(RSM, graph) connects a box start state to a box final state
+    # exactly when the nonterminal of the box derives the path between the
+    # graph vertices, which adds an edge labelled by that nonterminal.
+    # Only kron(RSM, new edges) of nonterminals that got new edges is built
+    # on the next iteration, and the closure is extended by it incrementally.
+    rsm_matrix = rsm_utils.rsm_to_sparse_matrix(rsm_utils.as_rsm(grammar, start_symbol))
+    rsm_smatrix = rsm_matrix.sparse_matrix
+    graph_smatrix = graph_to_sparse_matrix(graph)
+    size = len(graph_smatrix.numerated_states)
+
+    graph_matrices = {
+        symbol: csr_matrix(matrix, dtype=bool)
+        for symbol, matrix in graph_smatrix.matrix.items()
+    }
+    nullable = np.zeros(len(rsm_matrix.nonterminals), dtype=bool)
+    nullable[
+        rsm_matrix.box_of_state[rsm_matrix.start_mask & rsm_matrix.final_mask]
+    ] = True
+    for box_id, nonterminal in enumerate(rsm_matrix.nonterminals):
+        graph_matrices[nonterminal] = (
+            identity(size, dtype=bool, format="csr")
+            if nullable[box_id]
+            else csr_matrix((size, size), dtype=bool)
+        )
+
+    intersection = sparse_matrix_utils.intersect(
+        rsm_smatrix,
+        graph_smatrix._replace(
+            start_states=set(), final_states=set(), matrix=graph_matrices
+        ),
     )
+    product_size = len(rsm_smatrix.numerated_states) * size
+    closure = sparse_matrix_utils.transitive_closure(
+        sum(
+            intersection.matrix.values(),
+            csr_matrix((product_size, product_size), dtype=bool),
+        )
+    )
+    found = closure
+    while True:
+        rows, cols = found.nonzero()
+        states_from, vertices_from = np.divmod(rows, size)
+        states_to, vertices_to = np.divmod(cols, size)
+        boxes = rsm_matrix.box_of_state[states_from]
+        accepted = (
+            rsm_matrix.start_mask[states_from]
+            & rsm_matrix.final_mask[states_to]
+            & (boxes == rsm_matrix.box_of_state[states_to])
+        )
+
+        delta = None
+        for box_id in np.unique(boxes[accepted]).tolist():
+            nonterminal = rsm_matrix.nonterminals[box_id]
+            selected = accepted & (boxes == box_id)
+            new = (
+                csr_matrix(
+                    (
+                        np.ones(selected.sum(), dtype=bool),
+                        (vertices_from[selected], vertices_to[selected]),
+                    ),
+                    shape=(size, size),
+                    dtype=bool,
+                )
+                > graph_matrices[nonterminal]
+            )
+            graph_matrices[nonterminal] = graph_matrices[nonterminal] + new
+            if new.nnz > 0 and nonterminal in rsm_smatrix.matrix:
+                step = kron(rsm_smatrix.matrix[nonterminal], new, format="csr")
+                delta = step if delta is None else delta + step
+        if delta is None:
+            break
+        extended = sparse_matrix_utils.transitive_closure(closure, delta)
+        found = extended > closure
+        closure = extended
+
+    vertices = graph_smatrix.inversed_numerated_states
+    return {
+        (vertices[i], nonterminal, vertices[j])
+        for nonterminal in rsm_matrix.nonterminals
+        for i, j in zip(*graph_matrices[nonterminal].nonzero())
+    }
+
+
+CFPQ_ALGORITHMS = {
+    "hellings": hellings_cfpq,
+    "matrix": matrix_cfpq,
+    "tensor": tensor_cfpq,
+}
+
+
+def cfpq(
+    graph: MultiDiGraph,
+    cfg: Union[str, CFG],
+    start_nodes: set = None,
+    final_nodes: set = None,
+    start_symbol: str = "S",
+    algorithm: str = "matrix",
+) -> Set[Tuple]:
+    if algorithm not in CFPQ_ALGORITHMS:
+        raise ValueError(
+            f"Unknown algorithm {algorithm}, expected one of {list(CFPQ_ALGORITHMS)}"
+        )
+    return {
+        (node_from, node_to)
+        for node_from, variable, node_to in CFPQ_ALGORITHMS[algorithm](
+            graph, cfg, start_symbol
+        )
+        if variable == start_symbol
+        and (start_nodes is None or node_from in start_nodes)
+        and (final_nodes is None or node_to in final_nodes)
+    }
@@ -0,0 +1,123 @@
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+from typing import Tuple
+
+
+WORD_SIZE = 64
+
+
+def _words_count(cols: int) -> int:
+    return (cols + WORD_SIZE - 1) // WORD_SIZE
+
+
+class PackedBoolMatrix:
+    # Boolean matrix with every row packed into uint64 words: bit j of the row
+    # is bit j % 64 of word j // 64. Meant for minimized regex automata, which
+    # rarely have more than 64 states, so a row is usually a single word.
+    def __init__(self, words: np.ndarray, cols: int) -> None:
+        self.words = words
+        self.cols = cols
+        return
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.words.shape[0], self.cols
+
+    @classmethod
+    def zeros(cls, shape: Tuple[int, int]) -> "PackedBoolMatrix":
+        return cls(
+            np.zeros((shape[0], _words_count(shape[1])), dtype=np.uint64), shape[1]
+        )
+
+    @classmethod
+    def from_coo(cls, rows, cols, shape: Tuple[int, int]) -> "PackedBoolMatrix":
+        matrix = cls.zeros(shape)
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        bits = np.left_shift(np.uint64(1), (cols % WORD_SIZE).astype(np.uint64))
+        np.bitwise_or.at(matrix.words, (rows, cols // WORD_SIZE), bits)
+        return matrix
+
+    @classmethod
+    def from_matrix(cls, matrix) -> "PackedBoolMatrix":
+        if isinstance(matrix, PackedBoolMatrix):
+            return matrix
+        if issparse(matrix):
+            coo = matrix.tocoo()
+            nonzero = coo.data != 0
+            return cls.from_coo(coo.row[nonzero], coo.col[nonzero], coo.shape)
+        rows, cols = np.nonzero(np.asarray(matrix))
+        return cls.from_coo(rows, cols, np.shape(matrix))
+
+    def toarray(self) -> np.ndarray:
+        bits = np.unpackbits(
+            self.words.view(np.uint8).reshape(
+                self.words.shape[0], self.words.shape[1] * 8
+            ),
+            axis=1,
+            bitorder="little",
+        )
+        return bits[:, : self.cols].astype(bool)
+
+    def tocsr(self) -> csr_matrix:
+        return csr_matrix(self.toarray(), dtype=bool)
+
+    def nonzero(self) -> Tuple[np.ndarray, np.ndarray]:
+        return np.nonzero(self.toarray())
+
+    def count_nonzero(self) -> int:
+        return int(np.unpackbits(self.words.view(np.uint8)).sum())
+
+    def __or__(self, other: "PackedBoolMatrix") -> "PackedBoolMatrix":
+        return PackedBoolMatrix(self.words | other.words, self.cols)
+
+    def __add__(self, other: "PackedBoolMatrix") -> "PackedBoolMatrix":
+        return self | other
+
+    def __and__(self, other: "PackedBoolMatrix") -> "PackedBoolMatrix":
+        return PackedBoolMatrix(self.words & other.words, self.cols)
+
+    def __matmul__(self, other: "PackedBoolMatrix") -> "PackedBoolMatrix":
+        # Row i of the product is the OR of the rows k of other with bit k set
+        # in row i of self, computed for all rows at once.
+        selected = np.where(
+            self.toarray()[:, :, None], other.words[None, :, :], np.uint64(0)
+        )
+        return PackedBoolMatrix(np.bitwise_or.reduce(selected, axis=1), other.cols)
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, PackedBoolMatrix)
+            and self.cols == other.cols
+            and np.array_equal(self.words, other.words)
+        )
+
+
+def sparse_matmul_packed(sparse, packed: PackedBoolMatrix) -> PackedBoolMatrix:
+    # (sparse @ packed) row by row: the packed rows selected by the nonzero
+    # columns of every sparse row are ORed together with one reduceat call.
+    sparse = csr_matrix(sparse, dtype=bool)
+    sparse.eliminate_zeros()
+    result = PackedBoolMatrix.zeros((sparse.shape[0], packed.cols))
+    if sparse.nnz == 0:
+        return result
+    gathered = packed.words[sparse.indices]
+    nonempty = np.diff(sparse.indptr) > 0
+    result.words[nonempty] = np.bitwise_or.reduceat(
+        gathered, sparse.indptr[:-1][nonempty], axis=0
+    )
+    return result
+
+
+def sparse_kron_packed(sparse, packed: PackedBoolMatrix) -> csr_matrix:
+    # kron(sparse, packed) built from the nonzeros of both operands.
+    sparse = csr_matrix(sparse, dtype=bool).tocoo()
+    packed_rows, packed_cols = packed.nonzero()
+    block_rows, block_cols = packed.shape
+    rows = (sparse.row[:, None] * block_rows + packed_rows[None, :]).ravel()
+    cols = (sparse.col[:, None] * block_cols + packed_cols[None, :]).ravel()
+    return csr_matrix(
+        (np.ones(len(rows), dtype=bool), (rows, cols)),
+        shape=(sparse.shape[0] * block_rows, sparse.shape[1] * block_cols),
+        dtype=bool,
+    )
@@ -0,0 +1,52 @@
+from pyformlang.cfg import CFG, Production, Terminal, Variable
+from typing import Union
+
+
+def read_cfg(path: str, start_symbol: str = "S") -> CFG:
+    with open(path) as file:
+        return CFG.from_text(file.read(), Variable(start_symbol))
+
+
+def as_cfg(cfg: Union[str, CFG], start_symbol: str = "S") -> CFG:
+    if isinstance(cfg, CFG):
+        return cfg
+    return CFG.from_text(cfg, Variable(start_symbol))
+
+
+def cfg_to_wcnf(cfg: Union[str, CFG], start_symbol: str = "S") -> CFG:
+    # Weak Chomsky normal form: A -> B C, A -> a and A -> eps, where epsilon
+    # productions are kept and the start symbol may occur in bodies. Terminals
+    # of long bodies get their own variables, then long bodies are split into
+    # chains of pairs.
+    cfg = as_cfg(cfg, start_symbol)
+    cfg = cfg.eliminate_unit_productions().remove_useless_symbols()
+    names = {variable.value for variable in cfg.variables}
+
+    def fresh_variable(name: str) -> Variable:
+        while name in names:
+            name += "'"
+        names.add(name)
+        return Variable(name)
+
+    terminal_variables = dict()
+    productions = set()
+    for production in cfg.productions:
+        body = production.body
+        if len(body) < 2:
+            productions.add(production)
+            continue
+        symbols = []
+        for symbol in body:
+            if isinstance(symbol, Terminal):
+                if symbol not in terminal_variables:
+                    terminal_variables[symbol] = fresh_variable(f"{symbol.value}#T")
+                    productions.add(Production(terminal_variables[symbol], [symbol]))
+                symbol = terminal_variables[symbol]
+            symbols.append(symbol)
+        head = production.head
+        while len(symbols) > 2:
+            tail = fresh_variable(f"{production.head.value}#C{len(names)}")
+            productions.add(Production(head, [symbols[0], tail]))
+            head, symbols = tail, symbols[1:]
+        productions.add(Production(head, symbols))
+    return CFG(start_symbol=cfg.start_symbol, productions=productions)
@@ -1,6 +1,9 @@
-from typing import Tuple
+from typing import Set, Tuple
 import networkx as nx
+import numpy as np
+import pandas as pd
 import cfpq_data as cd
+import project.sparse_matrix_utils as sparse_matrix_utils
 
 
 class GraphData:
@@ -10,6 +13,16 @@ class GraphData:
         self.labels = set(cd.get_sorted_labels(graph))
         return
 
+    @classmethod
+    def from_counts(
+        cls, number_of_nodes: int, number_of_edges: int, labels: set
+    ) -> "GraphData":
+        graph_data = cls.__new__(cls)
+        graph_data.number_of_nodes = number_of_nodes
+        graph_data.number_of_edges = number_of_edges
+        graph_data.labels = labels
+        return graph_data
+
 
 def get_graph_info(graph_name: str) -> GraphData:
     return GraphData(cd.graph_from_csv(cd.download(graph_name)))
@@ -34,3 +47,90 @@ def read_graph_dot(path: str) -> nx.MultiDiGraph:
     if "\\n" in graph.nodes:
         graph.remove_node("\\n")
     return graph
+
+
+def read_graph_csv_matrices(
+    path: str,
+    start_nodes: Set = None,
+    final_nodes: Set = None,
+    chunk_size: int = 1_000_000,
+) -> Tuple[GraphData, sparse_matrix_utils.SparseMatrix]:
+    # Reads the "from to label" edge list consumed by cd.graph_from_csv in
+    # chunks, without building a networkx graph. Vertices and labels are
+    # interned to integers, so apart from the current chunk only 12 bytes
+    # per edge are kept until the per-label CSR matrices are built. Every
+    # chunk is read as strings, since pandas would guess the dtype of each
+    # chunk separately. Vertices and labels become numbers at the end, if
+    # all of them parse as ones.
+    nodes = pd.Index([])
+    symbols = pd.Index([])
+    rows, cols, labels = [], [], []
+    number_of_edges = 0
+
+    def intern(index: pd.Index, values: np.ndarray) -> pd.Index:
+        # Appends unseen values, so every chunk is looked up in the index
+        # instead of copying a whole dict into a Series.
+        values = pd.unique(values)
+        if index.empty:
+            return pd.Index(values)
+        unseen = values[index.get_indexer(values) < 0]
+        return index.append(pd.Index(unseen)) if len(unseen) else index
+
+    def as_numbers(index: pd.Index) -> pd.Index:
+        try:
+            return pd.Index(pd.to_numeric(index))
+        except (TypeError, ValueError):
+            return index
+
+    try:
+        chunks = pd.read_csv(
+            path,
+            sep=" ",
+            header=None,
+            names=["from", "to", "label"],
+            engine="c",
+            dtype=str,
+            chunksize=chunk_size,
+        )
+        for chunk in chunks:
+            nodes = intern(nodes, np.column_stack([chunk["from"], chunk["to"]]).ravel())
+            symbols = intern(symbols, chunk["label"].to_numpy())
+
+            rows.append(nodes.get_indexer(chunk["from"]).astype(np.int32))
+            cols.append(nodes.get_indexer(chunk["to"]).astype(np.int32))
+            labels.append(symbols.get_indexer(chunk["label"]).astype(np.int32))
+            number_of_edges += len(chunk)
+    except pd.errors.EmptyDataError:
+        pass
+
+    def concatenate(arrays: list) -> np.ndarray:
+        return np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int32)
+
+    nodes = as_numbers(nodes)
+    symbols = as_numbers(symbols).tolist()
+    matrix = sparse_matrix_utils.coo_to_bool_matrices(
+        concatenate(rows),
+        concatenate(cols),
+        concatenate(labels),
+        symbols,
+        len(nodes),
+    )
+    numerated_states = {
+        node.item() if isinstance(node, np.generic) else node: i
+        for i, node in enumerate(nodes.tolist())
+    }
+    if start_nodes is None:
+        start_nodes = numerated_states.keys()
+    if final_nodes is None:
+        final_nodes = numerated_states.keys()
+
+    graph_data = GraphData.from_counts(
+        len(numerated_states), number_of_edges, set(symbols)
+    )
+    return graph_data, sparse_matrix_utils.SparseMatrix(
+        numerated_states,
+        {i: node for node, i in numerated_states.items()},
+        {node for node in start_nodes if node in numerated_states},
+        {node for node in final_nodes if node in numerated_states},
+        matrix,
+    )
@@ -0,0 +1,167 @@
+from collections import Counter, defaultdict
+from networkx import MultiDiGraph
+from pyformlang.regular_expression import Regex
+from typing import Dict, Iterable, Set, Tuple, Union
+import project.automaton_utils as automaton_utils
+
+
+class MaterializedRpq:
+    # Keeps the answer of rpq(graph, regex, start_states, final_states) up to
+    # date under edge insertions and deletions.
+    #
+    # The state is the set of facts (s, q, v): vertex v is reached from start s
+    # by a nonempty path that leaves the regex DFA in state q. An inserted edge
+    # only extends the facts already present at its source vertex, so only
+    # the delta is propagated. A deleted edge invalidates the facts of the
+    # starts that could use it, and only those starts are recomputed.
+    def __init__(
+        self,
+        graph: MultiDiGraph,
+        regex: Union[str, Regex],
+        start_states: set = None,
+        final_states: set = None,
+    ) -> None:
+        regex_smatrix = automaton_utils.compile_regex(regex).sparse_matrix
+        self._regex_start_states = {
+            regex_smatrix.numerated_states[state]
+            for state in regex_smatrix.start_states
+        }
+        self._regex_final_states = {
+            regex_smatrix.numerated_states[state]
+            for state in regex_smatrix.final_states
+        }
+        self._transitions = dict()
+        for symbol, symbol_matrix in regex_smatrix.matrix.items():
+            for state_from, state_to in zip(*symbol_matrix.nonzero()):
+                self._transitions.setdefault(symbol, defaultdict(list))[
+                    int(state_from)
+                ].append(int(state_to))
+
+        self._all_starts = start_states is None
+        self._all_finals = final_states is None
+        self._start_states = set() if start_states is None else set(start_states)
+        self._final_states = set() if final_states is None else set(final_states)
+
+        self._out_edges = defaultdict(lambda: defaultdict(Counter))
+        self._vertices = set()
+        self._reached = defaultdict(set)
+        self._facts_by_start = defaultdict(set)
+        self._answers = Counter()
+
+        for vertex in graph.nodes:
+            self._add_vertex(vertex)
+        for node_from, node_to, label in graph.edges(data="label"):
+            if label is not None:
+                self._out_edges[node_from][label][node_to] += 1
+        for start in self._start_states:
+            self._recompute(start)
+        return
+
+    def result(self) -> Set[Tuple]:
+        return set(self._answers)
+
+    def add_edge(self, node_from, label, node_to) -> None:
+        self._add_vertex(node_from)
+        self._add_vertex(node_to)
+        self._out_edges[node_from][label][node_to] += 1
+        if self._out_edges[node_from][label][node_to] > 1:
+            return
+
+        worklist = []
+        for state_from, states_to in self._transitions_by(label).items():
+            for start in self._sources(state_from, node_from):
+                for state_to in states_to:
+                    if self._add_fact(start, state_to, node_to):
+                        worklist.append((start, state_to, node_to))
+        self._propagate(worklist)
+        return
+
+    def remove_edge(self, node_from, label, node_to) -> None:
+        edges = self._out_edges[node_from][label]
+        if edges[node_to] == 0:
+            raise KeyError((node_from, label, node_to))
+        edges[node_to] -= 1
+        if edges[node_to] > 0:
+            return
+        del edges[node_to]
+
+        affected_starts = set()
+        for state_from in self._transitions_by(label):
+            affected_starts |= self._sources(state_from, node_from)
+        for start in affected_starts:
+            self._recompute(start)
+        return
+
+    def add_edges(self, edges: Iterable[Tuple]) -> None:
+        for node_from, label, node_to in edges:
+            self.add_edge(node_from, label, node_to)
+        return
+
+    def remove_edges(self, edges: Iterable[Tuple]) -> None:
+        for node_from, label, node_to in edges:
+            self.remove_edge(node_from, label, node_to)
+        return
+
+    def _transitions_by(self, label) -> Dict:
+        return self._transitions.get(label, {})
+
+    def _add_vertex(self, vertex) -> None:
+        if vertex in self._vertices:
+            return
+        self._vertices.add(vertex)
+        if self._all_finals:
+            self._final_states.add(vertex)
+        if self._all_starts:
+            self._start_states.add(vertex)
+        return
+
+    def _is_seed(self, start, state: int, vertex) -> bool:
+        return (
+            start == vertex
+            and state in self._regex_start_states
+            and start in self._start_states
+        )
+
+    def _sources(self, state: int, vertex) -> set:
+        sources = set(self._reached.get((state, vertex), ()))
+        if self._is_seed(vertex, state, vertex):
+            sources.add(vertex)
+        return sources
+
+    def _add_fact(self, start, state: int, vertex) -> bool:
+        if start in self._reached[(state, vertex)]:
+            return False
+        self._reached[(state, vertex)].add(start)
+        self._facts_by_start[start].add((state, vertex))
+        if state in self._regex_final_states and vertex in self._final_states:
+            self._answers[(start, vertex)] += 1
+        return True
+
+    def _propagate(self, worklist: list) -> None:
+        while worklist:
+            start, state, vertex = worklist.pop()
+            for label, edges in self._out_edges[vertex].items():
+                states_to = self._transitions_by(label).get(state, ())
+                for state_to in states_to:
+                    for node_to in edges:
+                        if self._add_fact(start, state_to, node_to):
+                            worklist.append((start, state_to, node_to))
+        return
+
+    def _recompute(self, start) -> None:
+        for state, vertex in self._facts_by_start.pop(start, set()):
+            self._reached[(state, vertex)].discard(start)
+            if state in self._regex_final_states and vertex in self._final_states:
+                self._answers[(start, vertex)] -= 1
+                if self._answers[(start, vertex)] == 0:
+                    del self._answers[(start, vertex)]
+
+        worklist = []
+        for state in self._regex_start_states:
+            for label, edges in self._out_edges[start].items():
+                for state_to in self._transitions_by(label).get(state, ()):
+                    for node_to in edges:
+                        if self._add_fact(start, state_to, node_to):
+                            worklist.append((start, state_to, node_to))
+        self._propagate(worklist)
+        return
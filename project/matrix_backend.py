@@ -0,0 +1,141 @@
+from contextlib import contextmanager
+import numpy as np
+import scipy.linalg
+import scipy.sparse
+from scipy.sparse import coo_matrix, issparse
+from typing import Dict, Iterator
+
+
+class ScipyBackend:
+    # Keeps matrices in storage_format, but every product is computed in
+    # compute_format, since DOK and LIL are only fast for cell updates.
+    pack_regex = False
+
+    def __init__(self, name: str, storage_format: str, compute_format: str) -> None:
+        self.name = name
+        self.storage_format = storage_format
+        self.compute_format = compute_format
+        return
+
+    def from_coo(self, rows, cols, shape: tuple):
+        return coo_matrix(
+            (np.ones(len(rows), dtype=bool), (rows, cols)), shape=shape, dtype=bool
+        ).asformat(self.storage_format)
+
+    def zeros(self, shape: tuple):
+        return coo_matrix(shape, dtype=bool).asformat(self.storage_format)
+
+    def convert(self, matrix):
+        if not issparse(matrix):
+            matrix = coo_matrix(matrix, dtype=bool)
+        return matrix.asformat(self.storage_format)
+
+    def kron(self, matrix1, matrix2):
+        return scipy.sparse.kron(matrix1, matrix2, format=self.storage_format)
+
+    def block_diag(self, blocks: list):
+        return scipy.sparse.block_diag(blocks, format=self.storage_format)
+
+    def vstack(self, blocks: list):
+        return scipy.sparse.vstack(blocks, format=self.storage_format)
+
+    def matmul(self, matrix1, matrix2):
+        product = matrix1.asformat(self.compute_format) @ matrix2.asformat(
+            self.compute_format
+        )
+        return product.asformat(self.storage_format)
+
+    def add(self, matrix1, matrix2):
+        return (matrix1 + matrix2).asformat(self.storage_format)
+
+    def nnz(self, matrix) -> int:
+        return matrix.count_nonzero()
+
+
+class PackedRegexBackend(ScipyBackend):
+    # CSR for graph-side matrices, while the query functions bit-pack the
+    # regex automata into PackedBoolMatrix (see pack_sparse_matrix).
+    pack_regex = True
+
+
+class DenseBackend:
+    # Plain NumPy boolean arrays, only sensible for small automata and graphs.
+    name = "dense"
+    pack_regex = False
+
+    def from_coo(self, rows, cols, shape: tuple) -> np.ndarray:
+        matrix = np.zeros(shape, dtype=bool)
+        matrix[
+            np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        ] = True
+        return matrix
+
+    def zeros(self, shape: tuple) -> np.ndarray:
+        return np.zeros(shape, dtype=bool)
+
+    def convert(self, matrix) -> np.ndarray:
+        if issparse(matrix):
+            return matrix.toarray().astype(bool)
+        return np.asarray(matrix, dtype=bool)
+
+    def kron(self, matrix1, matrix2) -> np.ndarray:
+        return np.kron(self.convert(matrix1), self.convert(matrix2))
+
+    def block_diag(self, blocks: list) -> np.ndarray:
+        return scipy.linalg.block_diag(*[self.convert(b) for b in blocks]).astype(bool)
+
+    def vstack(self, blocks: list) -> np.ndarray:
+        return np.vstack([self.convert(b) for b in blocks])
+
+    def matmul(self, matrix1, matrix2) -> np.ndarray:
+        return self.convert(matrix1) @ self.convert(matrix2)
+
+    def add(self, matrix1, matrix2) -> np.ndarray:
+        return self.convert(matrix1) | self.convert(matrix2)
+
+    def nnz(self, matrix) -> int:
+        return int(np.count_nonzero(matrix))
+
+
+BACKENDS = {
+    "csr": ScipyBackend("csr", "csr", "csr"),
+    "csc": ScipyBackend("csc", "csc", "csc"),
+    "dok": ScipyBackend("dok", "dok", "csr"),
+    "lil": ScipyBackend("lil", "lil", "csr"),
+    "dense": DenseBackend(),
+    "packed": PackedRegexBackend("packed", "csr", "csr"),
+}
+
+_current_backend = "csr"
+
+
+def register_backend(backend) -> None:
+    BACKENDS[backend.name] = backend
+    return
+
+
+def get_backend():
+    return BACKENDS[_current_backend]
+
+
+def set_backend(name: str) -> None:
+    global _current_backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name}, expected one of {list(BACKENDS)}")
+    _current_backend = name
+    return
+
+
+@contextmanager
+def use_backend(name: str) -> Iterator:
+    previous = _current_backend
+    set_backend(name)
+    try:
+        yield BACKENDS[name]
+    finally:
+        set_backend(previous)
+
+
+def convert_matrices(matrix: Dict, backend=None) -> Dict:
+    backend = backend or get_backend()
+    return {symbol: backend.convert(m) for symbol, m in matrix.items()}
@@ -0,0 +1,187 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from scipy.sparse import csr_matrix
+from typing import Dict, List, Tuple, Union
+import project.sparse_matrix_utils as sparse_matrix_utils
+from project.rpq_result import RpqResult
+from project.sparse_matrix_utils import SparseMatrix
+
+
+EXECUTORS = ("serial", "thread", "process")
+
+# Per-worker state of the process pool, filled by _init_worker.
+_worker_state = dict()
+
+
+def share_matrices(matrix: Dict) -> Tuple[List[SharedMemory], List]:
+    # Copies CSR arrays of every symbol matrix into shared memory blocks.
+    # The returned layout is small and picklable, workers rebuild matrices
+    # from it. The caller owns the blocks and has to unlink them.
+    blocks = []
+    layout = []
+    for symbol, symbol_matrix in matrix.items():
+        symbol_matrix = csr_matrix(symbol_matrix, dtype=bool)
+        arrays = []
+        for array in (symbol_matrix.data, symbol_matrix.indices, symbol_matrix.indptr):
+            block = SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+            blocks.append(block)
+            arrays.append((block.name, array.dtype.str, array.shape))
+        layout.append((symbol, symbol_matrix.shape, arrays))
+    return blocks, layout
+
+
+def attach_matrices(layout: List) -> Tuple[List[SharedMemory], Dict]:
+    blocks = []
+    matrix = dict()
+    for symbol, shape, arrays in layout:
+        views = []
+        for name, dtype, array_shape in arrays:
+            block = SharedMemory(name=name)
+            blocks.append(block)
+            views.append(np.ndarray(array_shape, dtype=dtype, buffer=block.buf))
+        matrix[symbol] = csr_matrix(tuple(views), shape=shape, copy=False)
+    return blocks, matrix
+
+
+def _init_worker(
+    layout: List,
+    nodes: List,
+    final_states: set,
+    regex_smatrix: SparseMatrix,
+    foreach_start_node: bool,
+) -> None:
+    blocks, matrix = attach_matrices(layout)
+    graph_smatrix = SparseMatrix(
+        {node: i for i, node in enumerate(nodes)},
+        dict(enumerate(nodes)),
+        set(),
+        final_states,
+        matrix,
+    )
+    _worker_state.update(
+        blocks=blocks,
+        graph_smatrix=graph_smatrix,
+        regex_smatrix=regex_smatrix,
+        # The graph blocks stay views of the shared memory, only the small
+        # regex blocks are private to the worker.
+        direct_sum=sparse_matrix_utils.direct_sum_matrices(
+            graph_smatrix, regex_smatrix, split=True
+        ),
+        foreach_start_node=foreach_start_node,
+    )
+
+
+def _run_chunk(start_states: List) -> Tuple[np.ndarray, ...]:
+    # Answers travel back as index arrays, which pickle much cheaper than sets.
+    return sparse_matrix_utils.bfs(
+        _worker_state["graph_smatrix"]._replace(start_states=set(start_states)),
+        _worker_state["regex_smatrix"],
+        _worker_state["foreach_start_node"],
+        _worker_state["direct_sum"],
+        lazy_result=True,
+    ).to_numpy(mapped=False)
+
+
+def _merge_chunks(
+    graph_smatrix: SparseMatrix, chunks_arrays: List, foreach_start_node: bool
+) -> RpqResult:
+    empty = np.zeros(0, dtype=np.int64)
+    arrays = [
+        np.concatenate([chunk[i] for chunk in chunks_arrays] or [empty])
+        for i in range(2 if foreach_start_node else 1)
+    ]
+    return RpqResult(
+        graph_smatrix.inversed_numerated_states,
+        graph_smatrix.numerated_states,
+        arrays[-1],
+        arrays[0] if foreach_start_node else None,
+    )
+
+
+def split_start_states(start_states: set, chunks_count: int) -> List[List]:
+    start_states = list(start_states)
+    chunk_size = max(1, -(-len(start_states) // chunks_count))
+    return [
+        start_states[i : i + chunk_size]
+        for i in range(0, len(start_states), chunk_size)
+    ]
+
+
+def parallel_bfs(
+    graph_smatrix: SparseMatrix,
+    regex_smatrix: SparseMatrix,
+    foreach_start_node: bool = False,
+    executor: str = "serial",
+    workers: int = None,
+    lazy_result: bool = False,
+) -> Union[set, RpqResult]:
+    # Reachability from disjoint subsets of start states is independent,
+    # so the chunks are solved separately and their answers are merged.
+    if executor not in EXECUTORS:
+        raise ValueError(f"Unknown executor {executor}, expected one of {EXECUTORS}")
+    if executor == "serial":
+        return sparse_matrix_utils.bfs(
+            graph_smatrix, regex_smatrix, foreach_start_node, lazy_result=lazy_result
+        )
+
+    workers = workers or os.cpu_count() or 1
+    chunks = split_start_states(graph_smatrix.start_states, workers * 4)
+
+    if executor == "thread":
+        direct_sum = sparse_matrix_utils.direct_sum_matrices(
+            graph_smatrix, regex_smatrix
+        )
+        with ThreadPoolExecutor(workers) as pool:
+            chunks_arrays = list(
+                pool.map(
+                    lambda chunk: sparse_matrix_utils.bfs(
+                        graph_smatrix._replace(start_states=set(chunk)),
+                        regex_smatrix,
+                        foreach_start_node,
+                        direct_sum,
+                        lazy_result=True,
+                    ).to_numpy(mapped=False),
+                    chunks,
+                )
+            )
+    else:
+        chunks_arrays = _run_process_pool(
+            graph_smatrix, regex_smatrix, foreach_start_node, workers, chunks
+        )
+
+    ans = _merge_chunks(graph_smatrix, chunks_arrays, foreach_start_node)
+    return ans if lazy_result else set(ans)
+
+
+def _run_process_pool(
+    graph_smatrix: SparseMatrix,
+    regex_smatrix: SparseMatrix,
+    foreach_start_node: bool,
+    workers: int,
+    chunks: List,
+) -> List:
+    nodes = [
+        graph_smatrix.inversed_numerated_states[i]
+        for i in range(len(graph_smatrix.inversed_numerated_states))
+    ]
+    blocks, layout = share_matrices(graph_smatrix.matrix)
+    try:
+        with ProcessPoolExecutor(
+            workers,
+            initializer=_init_worker,
+            initargs=(
+                layout,
+                nodes,
+                set(graph_smatrix.final_states),
+                regex_smatrix,
+                foreach_start_node,
+            ),
+        ) as pool:
+            return list(pool.map(_run_chunk, chunks))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
@@ -0,0 +1,130 @@
+from collections import namedtuple
+from contextlib import contextmanager
+from time import perf_counter
+import numpy as np
+from scipy.sparse import issparse
+from typing import Callable, Dict, Iterator
+from project.bit_matrix import PackedBoolMatrix
+
+
+# nnz holds the nonzeros of the matrix reported on every iteration of the
+# phase, matrix_bytes the memory of the matrices reported as its output.
+PhaseRecord = namedtuple(
+    "PhaseRecord", ["name", "seconds", "iterations", "nnz", "matrix_bytes"]
+)
+
+
+def matrix_nbytes(matrix) -> int:
+    if isinstance(matrix, dict):
+        return sum(matrix_nbytes(m) for m in matrix.values())
+    if isinstance(matrix, np.ndarray):
+        return matrix.nbytes
+    if isinstance(matrix, PackedBoolMatrix):
+        return matrix.words.nbytes
+    if issparse(matrix):
+        if matrix.format in ("csr", "csc", "bsr"):
+            return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+        if matrix.format == "coo":
+            return matrix.data.nbytes + matrix.row.nbytes + matrix.col.nbytes
+        # dok and lil keep Python objects, count one index pair per nonzero.
+        return matrix.nnz * 2 * np.dtype(np.int64).itemsize
+    return 0
+
+
+class Profile:
+    # Records of the phases finished while the profile is active, callback
+    # (if any) is called with every record as soon as its phase ends.
+    def __init__(self, callback: Callable[[PhaseRecord], None] = None) -> None:
+        self.records = []
+        self.callback = callback
+        return
+
+    def add(self, record: PhaseRecord) -> None:
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+        return
+
+    def totals(self) -> Dict[str, float]:
+        totals = dict()
+        for record in self.records:
+            totals[record.name] = totals.get(record.name, 0.0) + record.seconds
+        return totals
+
+
+class _Phase:
+    def __init__(self, name: str, profile: Profile) -> None:
+        self.name = name
+        self.profile = profile
+        self.iterations = 0
+        self.nnz = []
+        self.matrix_bytes = 0
+        return
+
+    def __enter__(self) -> "_Phase":
+        self._begin = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.profile.add(
+            PhaseRecord(
+                self.name,
+                perf_counter() - self._begin,
+                self.iterations,
+                self.nnz,
+                self.matrix_bytes,
+            )
+        )
+        return
+
+    def iteration(self, matrix=None) -> None:
+        self.iterations += 1
+        if matrix is None:
+            return
+        if issparse(matrix):
+            self.nnz.append(int(matrix.nnz))
+        elif isinstance(matrix, PackedBoolMatrix):
+            self.nnz.append(matrix.count_nonzero())
+        else:
+            self.nnz.append(int(np.count_nonzero(matrix)))
+        return
+
+    def output(self, matrix) -> None:
+        self.matrix_bytes += matrix_nbytes(matrix)
+        return
+
+
+class _NullPhase:
+    # Shared stand-in while profiling is off, every hook is a no-op.
+    def __enter__(self) -> "_NullPhase":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        return
+
+    def iteration(self, matrix=None) -> None:
+        return
+
+    def output(self, matrix) -> None:
+        return
+
+
+_NULL_PHASE = _NullPhase()
+_active_profile = None
+
+
+def phase(name: str):
+    if _active_profile is None:
+        return _NULL_PHASE
+    return _Phase(name, _active_profile)
+
+
+@contextmanager
+def profile(callback: Callable[[PhaseRecord], None] = None) -> Iterator[Profile]:
+    global _active_profile
+    previous = _active_profile
+    _active_profile = Profile(callback)
+    try:
+        yield _active_profile
+    finally:
+        _active_profile = previous
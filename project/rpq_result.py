@@ -0,0 +1,114 @@
+import numpy as np
+from typing import Iterable, Iterator, Mapping, Tuple
+
+
+class RpqResult:
+    # Compact answer of an rpq query. Answers are kept as sorted unique int64
+    # keys: start * states_count + end for pairs, end alone for vertex sets.
+    # Matrix indices are mapped to vertices only when an answer is accessed.
+    def __init__(
+        self,
+        inversed_numerated_states: Mapping,
+        numerated_states: Mapping,
+        ends: np.ndarray,
+        starts: np.ndarray = None,
+    ) -> None:
+        self._inversed_numerated_states = inversed_numerated_states
+        self._numerated_states = numerated_states
+        self._states_count = len(inversed_numerated_states)
+        self.is_pairs = starts is not None
+        ends = np.asarray(ends, dtype=np.int64)
+        if self.is_pairs:
+            starts = np.asarray(starts, dtype=np.int64)
+            self._keys = np.unique(starts * self._states_count + ends)
+        else:
+            self._keys = np.unique(ends)
+        return
+
+    @classmethod
+    def from_answers(
+        cls,
+        inversed_numerated_states: Mapping,
+        numerated_states: Mapping,
+        answers: Iterable,
+        pairs: bool,
+    ) -> "RpqResult":
+        # Wraps answers that are already vertices, e.g. of a limited query.
+        if pairs:
+            indices = [
+                (numerated_states[start], numerated_states[end])
+                for start, end in answers
+            ]
+            starts, ends = np.array(indices, dtype=np.int64).reshape(-1, 2).T
+            return cls(inversed_numerated_states, numerated_states, ends, starts)
+        ends = [numerated_states[end] for end in answers]
+        return cls(inversed_numerated_states, numerated_states, ends)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __iter__(self) -> Iterator:
+        for begin in range(0, len(self._keys), 4096):
+            yield from self._decode(self._keys[begin : begin + 4096])
+
+    def __contains__(self, item) -> bool:
+        try:
+            if self.is_pairs:
+                start, end = item
+                key = (
+                    self._numerated_states[start] * self._states_count
+                    + self._numerated_states[end]
+                )
+            else:
+                key = self._numerated_states[item]
+        except (KeyError, TypeError, ValueError):
+            return False
+        position = np.searchsorted(self._keys, key)
+        return position < len(self._keys) and self._keys[position] == key
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, RpqResult):
+            return set(self) == set(other)
+        if isinstance(other, (set, frozenset)):
+            return len(self) == len(other) and all(item in self for item in other)
+        return NotImplemented
+
+    def to_numpy(self, mapped: bool = True) -> Tuple[np.ndarray, ...]:
+        # Index arrays (starts, ends) or (ends,), or the same arrays of vertices.
+        if self.is_pairs:
+            starts, ends = np.divmod(self._keys, self._states_count)
+            arrays = (starts, ends)
+        else:
+            arrays = (self._keys.copy(),)
+        if not mapped:
+            return arrays
+        return tuple(self._map(array) for array in arrays)
+
+    def to_set(self) -> set:
+        return set(self)
+
+    def to_csv(self, path: str, sep: str = " ") -> None:
+        with open(path, "w") as output:
+            for answer in self:
+                if self.is_pairs:
+                    output.write(f"{answer[0]}{sep}{answer[1]}\n")
+                else:
+                    output.write(f"{answer}\n")
+        return
+
+    def _map(self, indices: np.ndarray) -> np.ndarray:
+        vertices = np.empty(len(indices), dtype=object)
+        vertices[:] = [self._inversed_numerated_states[i] for i in indices.tolist()]
+        return vertices
+
+    def _decode(self, keys: np.ndarray) -> Iterator:
+        if not self.is_pairs:
+            return (self._inversed_numerated_states[key] for key in keys.tolist())
+        starts, ends = np.divmod(keys, self._states_count)
+        return (
+            (
+                self._inversed_numerated_states[start],
+                self._inversed_numerated_states[end],
+            )
+            for start, end in zip(starts.tolist(), ends.tolist())
+        )
@@ -0,0 +1,135 @@
+from collections import namedtuple
+import numpy as np
+from pyformlang.cfg import CFG, Variable
+from pyformlang.regular_expression import Regex
+from typing import Union
+import project.cfg_utils as cfg_utils
+import project.sparse_matrix_utils as sparse_matrix_utils
+from project.sparse_matrix_utils import SparseMatrix
+
+
+# Extended CFG: exactly one regex body over terminals and nonterminals for
+# every nonterminal.
+ECFG = namedtuple("ECFG", ["start_symbol", "productions"])
+
+# Recursive state machine: one finite automaton (box) for every nonterminal.
+RSM = namedtuple("RSM", ["start_symbol", "boxes"])
+
+
+def ecfg_from_text(text: str, start_symbol: str = "S") -> ECFG:
+    # One "A -> regex" rule per line, repeated heads are joined by union.
+    bodies = dict()
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        head, body = line.split("->", 1)
+        bodies.setdefault(Variable(head.strip()), []).append(body.strip() or "$")
+    return ECFG(
+        Variable(start_symbol),
+        {
+            head: Regex(" | ".join(f"({body})" for body in head_bodies))
+            for head, head_bodies in bodies.items()
+        },
+    )
+
+
+def read_ecfg(path: str, start_symbol: str = "S") -> ECFG:
+    with open(path) as file:
+        return ecfg_from_text(file.read(), start_symbol)
+
+
+def cfg_to_ecfg(cfg: Union[str, CFG], start_symbol: str = "S") -> ECFG:
+    cfg = cfg_utils.as_cfg(cfg, start_symbol)
+    bodies = dict()
+    for production in cfg.productions:
+        bodies.setdefault(production.head, []).append(
+            " ".join(symbol.value for symbol in production.body) or "$"
+        )
+    return ECFG(
+        cfg.start_symbol,
+        {head: Regex(" | ".join(head_bodies)) for head, head_bodies in bodies.items()},
+    )
+
+
+def ecfg_to_rsm(ecfg: ECFG) -> RSM:
+    return RSM(
+        ecfg.start_symbol,
+        {head: body.to_epsilon_nfa() for head, body in ecfg.productions.items()},
+    )
+
+
+def minimize_rsm(rsm: RSM) -> RSM:
+    return RSM(
+        rsm.start_symbol, {head: box.minimize() for head, box in rsm.boxes.items()}
+    )
+
+
+def as_rsm(grammar: Union[str, CFG, ECFG, RSM], start_symbol: str = "S") -> RSM:
+    if isinstance(grammar, RSM):
+        return grammar
+    if isinstance(grammar, str):
+        grammar = ecfg_from_text(grammar, start_symbol)
+    elif isinstance(grammar, CFG):
+        grammar = cfg_to_ecfg(grammar)
+    return minimize_rsm(ecfg_to_rsm(grammar))
+
+
+# Boxes of an RSM laid out in one SparseMatrix: box of every state index,
+# and start and final masks over state indices.
+RsmMatrix = namedtuple(
+    "RsmMatrix",
+    ["sparse_matrix", "nonterminals", "box_of_state", "start_mask", "final_mask"],
+)
+
+
+def rsm_to_sparse_matrix(rsm: RSM) -> RsmMatrix:
+    # States are (nonterminal, box state) pairs, symbols of the matrices are
+    # the values of terminals and nonterminals.
+    nonterminals = [head.value for head in rsm.boxes]
+    numerated_states = dict()
+    box_of_state = []
+    symbol_ids = dict()
+    rows, cols, labels = [], [], []
+    start_states, final_states = set(), set()
+
+    for box_id, (head, box) in enumerate(rsm.boxes.items()):
+        if not box.is_deterministic():
+            box = box.to_deterministic()
+        for state in box.states:
+            numerated_states[(head.value, state)] = len(numerated_states)
+            box_of_state.append(box_id)
+        start_states |= {(head.value, state) for state in box.start_states}
+        final_states |= {(head.value, state) for state in box.final_states}
+        for state_from, transitions in box.to_dict().items():
+            for symbol, states_to in transitions.items():
+                if not isinstance(states_to, set):
+                    states_to = {states_to}
+                for state_to in states_to:
+                    rows.append(numerated_states[(head.value, state_from)])
+                    cols.append(numerated_states[(head.value, state_to)])
+                    labels.append(symbol_ids.setdefault(symbol.value, len(symbol_ids)))
+
+    sparse_matrix = SparseMatrix(
+        numerated_states,
+        {i: state for state, i in numerated_states.items()},
+        start_states,
+        final_states,
+        sparse_matrix_utils.coo_to_bool_matrices(
+            np.array(rows, dtype=np.int64),
+            np.array(cols, dtype=np.int64),
+            np.array(labels, dtype=np.int64),
+            list(symbol_ids.keys()),
+            len(numerated_states),
+        ),
+    )
+    start_mask = np.zeros(len(numerated_states), dtype=bool)
+    start_mask[[numerated_states[state] for state in start_states]] = True
+    final_mask = np.zeros(len(numerated_states), dtype=bool)
+    final_mask[[numerated_states[state] for state in final_states]] = True
+    return RsmMatrix(
+        sparse_matrix,
+        nonterminals,
+        np.array(box_of_state, dtype=np.int64),
+        start_mask,
+        final_mask,
+    )
@@ -1,7 +1,18 @@
 from collections import namedtuple
+import math
+import numpy as np
 from pyformlang.finite_automaton import NondeterministicFiniteAutomaton as NFA, State
-from scipy.sparse import block_diag, dok_matrix, kron, vstack
-from typing import Dict
+from scipy.sparse import csr_matrix, hstack, kron, spmatrix
+from time import perf_counter
+from typing import Callable, Dict, Iterator, Tuple, Union
+import project.matrix_backend as matrix_backend
+import project.profiling as profiling
+from project.bit_matrix import (
+    PackedBoolMatrix,
+    sparse_kron_packed,
+    sparse_matmul_packed,
+)
+from project.rpq_result import RpqResult
 
 
 SparseMatrix = namedtuple(
@@ -16,6 +27,28 @@ SparseMatrix = namedtuple(
 )
 
 
+def coo_to_bool_matrices(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    labels: np.ndarray,
+    symbols: list,
+    size: int,
+) -> Dict:
+    # Transitions are grouped by label once, each symbol matrix is built in one call.
+    backend = matrix_backend.get_backend()
+    order = np.argsort(labels, kind="stable")
+    rows, cols, labels = rows[order], cols[order], labels[order]
+    bounds = np.searchsorted(labels, np.arange(len(symbols) + 1))
+
+    matrix = dict()
+    for label_id, symbol in enumerate(symbols):
+        begin, end = bounds[label_id], bounds[label_id + 1]
+        matrix[symbol] = backend.from_coo(
+            rows[begin:end], cols[begin:end], (size, size)
+        )
+    return matrix
+
+
 def nfa_to_sparse_matrix(nfa: NFA) -> SparseMatrix:
     numerated_states = dict()
     inversed_numerated_states = dict()
@@ -25,25 +58,30 @@ def nfa_to_sparse_matrix(nfa: NFA) -> SparseMatrix:
         inversed_numerated_states[i] = state
         i += 1
 
-    nfa_dict = nfa.to_dict()
-    matrix = dict()
+    symbols = list(nfa.symbols)
+    symbol_ids = {symbol: i for i, symbol in enumerate(symbols)}
+    rows, cols, labels = [], [], []
 
-    for symbol in nfa.symbols:
-        curr_symbol_matrix = dok_matrix((len(nfa.states), len(nfa.states)), dtype=bool)
-        for state_from, transitions in nfa_dict.items():
+    for state_from, transitions in nfa.to_dict().items():
+        for symbol, states_to in transitions.items():
+            # Epsilon transitions are not symbols of the nfa and get no matrix.
+            if symbol not in symbol_ids:
+                continue
             # States that can be reached from the state_from in one step.
-            states_to = set()
-            if symbol in transitions:
-                states_to = transitions[symbol]
             if type(states_to) is State:
                 states_to = {states_to}
-
             for state_to in states_to:
-                curr_symbol_matrix[
-                    numerated_states[state_from], numerated_states[state_to]
-                ] = True
+                rows.append(numerated_states[state_from])
+                cols.append(numerated_states[state_to])
+                labels.append(symbol_ids[symbol])
 
-        matrix[symbol] = curr_symbol_matrix
+    matrix = coo_to_bool_matrices(
+        np.array(rows, dtype=np.int64),
+        np.array(cols, dtype=np.int64),
+        np.array(labels, dtype=np.int64),
+        symbols,
+        len(nfa.states),
+    )
 
     return SparseMatrix(
         numerated_states,
@@ -54,12 +92,20 @@ def nfa_to_sparse_matrix(nfa: NFA) -> SparseMatrix:
     )
 
 
+def pack_sparse_matrix(sparse_matrix: SparseMatrix) -> SparseMatrix:
+    return sparse_matrix._replace(
+        matrix={
+            symbol: PackedBoolMatrix.from_matrix(m)
+            for symbol, m in sparse_matrix.matrix.items()
+        }
+    )
+
+
 def sparse_matrix_to_nfa(sparse_matrix: SparseMatrix) -> NFA:
     nfa = NFA()
 
     for symbol in sparse_matrix.matrix.keys():
-        for key in sparse_matrix.matrix[symbol].keys():
-            state_from, state_to = key
+        for state_from, state_to in zip(*sparse_matrix.matrix[symbol].nonzero()):
             nfa.add_transition(
                 sparse_matrix.inversed_numerated_states[state_from],
                 symbol,
@@ -79,32 +125,42 @@ def intersect(
 ) -> SparseMatrix:
     symbols = sparse_matrix1.matrix.keys() & sparse_matrix2.matrix.keys()
 
-    numerated_states = {}
-    start_states = set()
-    final_states = set()
+    states_count2 = len(sparse_matrix2.numerated_states)
+    numerated_states = {
+        state: state
+        for state in range(len(sparse_matrix1.numerated_states) * states_count2)
+    }
     matrix = dict()
 
-    for state1, state1_number in sparse_matrix1.numerated_states.items():
-        for state2, state2_number in sparse_matrix2.numerated_states.items():
-            state = len(sparse_matrix2.numerated_states) * state1_number + state2_number
-            numerated_states[state] = state
-
-            if (
-                state1 in sparse_matrix1.start_states
-                and state2 in sparse_matrix2.start_states
-            ):
-                start_states.add(state)
+    def product_states(states1: set, states2: set) -> set:
+        return {
+            states_count2 * sparse_matrix1.numerated_states[state1]
+            + sparse_matrix2.numerated_states[state2]
+            for state1 in states1
+            for state2 in states2
+        }
 
-            if (
-                state1 in sparse_matrix1.final_states
-                and state2 in sparse_matrix2.final_states
-            ):
-                final_states.add(state)
+    start_states = product_states(
+        sparse_matrix1.start_states, sparse_matrix2.start_states
+    )
+    final_states = product_states(
+        sparse_matrix1.final_states, sparse_matrix2.final_states
+    )
 
-    for symbol in symbols:
-        matrix[symbol] = kron(
-            sparse_matrix1.matrix[symbol], sparse_matrix2.matrix[symbol], format="dok"
-        )
+    with profiling.phase("intersect") as timer:
+        backend = matrix_backend.get_backend()
+        for symbol in symbols:
+            if isinstance(sparse_matrix2.matrix[symbol], PackedBoolMatrix):
+                matrix[symbol] = backend.convert(
+                    sparse_kron_packed(
+                        sparse_matrix1.matrix[symbol], sparse_matrix2.matrix[symbol]
+                    )
+                )
+            else:
+                matrix[symbol] = backend.kron(
+                    sparse_matrix1.matrix[symbol], sparse_matrix2.matrix[symbol]
+                )
+        timer.output(matrix)
 
     inversed_numerated_states = numerated_states
 
@@ -113,98 +169,1152 @@ def intersect(
     )
 
 
+# Array-backed counterpart of SparseMatrix: vertices live in a NumPy array,
+# start/final states are boolean masks over state indices and matrices are
+# keyed by the index of their symbol in symbols. Products do not store their
+# states at all, state k of a product is (k // n2, k % n2) of its factors,
+# so states is None for them.
+CompactSparseMatrix = namedtuple(
+    "CompactSparseMatrix",
+    [
+        "states",
+        "symbols",
+        "start_mask",
+        "final_mask",
+        "matrix",
+    ],
+)
+
+
+def _states_mask(sparse_matrix: SparseMatrix, states) -> np.ndarray:
+    mask = np.zeros(len(sparse_matrix.numerated_states), dtype=bool)
+    mask[[sparse_matrix.numerated_states[state] for state in states]] = True
+    return mask
+
+
+def _as_compact_matrix(matrix):
+    if isinstance(matrix, PackedBoolMatrix):
+        return matrix
+    return csr_matrix(matrix, dtype=bool)
+
+
+def to_compact(sparse_matrix: SparseMatrix) -> CompactSparseMatrix:
+    states_count = len(sparse_matrix.numerated_states)
+    states = np.empty(states_count, dtype=object)
+    states[:] = [
+        sparse_matrix.inversed_numerated_states[i] for i in range(states_count)
+    ]
+    symbols = list(sparse_matrix.matrix.keys())
+
+    return CompactSparseMatrix(
+        states,
+        symbols,
+        _states_mask(sparse_matrix, sparse_matrix.start_states),
+        _states_mask(sparse_matrix, sparse_matrix.final_states),
+        {
+            i: _as_compact_matrix(sparse_matrix.matrix[symbol])
+            for i, symbol in enumerate(symbols)
+        },
+    )
+
+
+def from_compact(compact: CompactSparseMatrix) -> SparseMatrix:
+    states = (
+        compact.states
+        if compact.states is not None
+        else np.arange(len(compact.start_mask))
+    )
+    inversed_numerated_states = {i: state for i, state in enumerate(states.tolist())}
+    return SparseMatrix(
+        {state: i for i, state in inversed_numerated_states.items()},
+        inversed_numerated_states,
+        {inversed_numerated_states[i] for i in np.flatnonzero(compact.start_mask)},
+        {inversed_numerated_states[i] for i in np.flatnonzero(compact.final_mask)},
+        {compact.symbols[i]: m for i, m in compact.matrix.items()},
+    )
+
+
+def compact_intersect(
+    compact1: CompactSparseMatrix, compact2: CompactSparseMatrix
+) -> CompactSparseMatrix:
+    symbol_ids2 = {symbol: i for i, symbol in enumerate(compact2.symbols)}
+    symbols = []
+    matrix = dict()
+    with profiling.phase("intersect") as timer:
+        for symbol_id1, symbol in enumerate(compact1.symbols):
+            if symbol not in symbol_ids2:
+                continue
+            matrix2 = compact2.matrix[symbol_ids2[symbol]]
+            if isinstance(matrix2, PackedBoolMatrix):
+                matrix[len(symbols)] = sparse_kron_packed(
+                    compact1.matrix[symbol_id1], matrix2
+                )
+            else:
+                matrix[len(symbols)] = kron(
+                    compact1.matrix[symbol_id1], matrix2, format="csr"
+                )
+            symbols.append(symbol)
+        timer.output(matrix)
+
+    return CompactSparseMatrix(
+        None,
+        symbols,
+        np.outer(compact1.start_mask, compact2.start_mask).ravel(),
+        np.outer(compact1.final_mask, compact2.final_mask).ravel(),
+        matrix,
+    )
+
+
+def split_product_states(states: np.ndarray, right_states_count: int) -> Tuple:
+    return np.divmod(states, right_states_count)
+
+
+def _reachable(adjacency: csr_matrix, mask: np.ndarray) -> np.ndarray:
+    # States reached from mask by at least one step along adjacency rows.
+    visited = np.zeros(len(mask), dtype=bool)
+    front = mask
+    while front.any():
+        front = (adjacency.T @ front) & ~visited
+        visited |= front
+    return visited
+
+
+def prune_states(sparse_matrix: SparseMatrix) -> SparseMatrix:
+    # Keeps only the states lying on a nonempty path from a start state to a
+    # final state: a start state reaching a final one, a final state reached
+    # from a start one, or a state in between.
+    states_count = len(sparse_matrix.numerated_states)
+    adjacency = csr_matrix((states_count, states_count), dtype=bool)
+    for symbol_matrix in sparse_matrix.matrix.values():
+        adjacency = adjacency + csr_matrix(symbol_matrix, dtype=bool)
+    start_mask = _states_mask(sparse_matrix, sparse_matrix.start_states)
+    final_mask = _states_mask(sparse_matrix, sparse_matrix.final_states)
+    forward = _reachable(adjacency, start_mask)
+    backward = _reachable(adjacency.T.tocsr(), final_mask)
+    keep = (start_mask & backward) | (forward & final_mask) | (forward & backward)
+    if keep.all():
+        return sparse_matrix
+
+    kept = np.flatnonzero(keep)
+    vertices = [sparse_matrix.inversed_numerated_states[i] for i in kept.tolist()]
+    numerated_states = {vertex: i for i, vertex in enumerate(vertices)}
+    backend = matrix_backend.get_backend()
+    return SparseMatrix(
+        numerated_states,
+        dict(enumerate(vertices)),
+        {state for state in sparse_matrix.start_states if state in numerated_states},
+        {state for state in sparse_matrix.final_states if state in numerated_states},
+        {
+            symbol: backend.convert(
+                csr_matrix(symbol_matrix, dtype=bool)[kept][:, kept]
+            )
+            for symbol, symbol_matrix in sparse_matrix.matrix.items()
+        },
+    )
+
+
+def transitive_closure(matrix: spmatrix, delta: spmatrix = None) -> spmatrix:
+    # Semi-naive closure: after pass k the closure holds every pair whose
+    # shortest path has at most 2 ** k edges and delta the pairs first found
+    # on that pass. A shortest path of up to 2 ** (k + 1) edges splits into a
+    # prefix of exactly 2 ** k edges, which is in delta, and a suffix that is
+    # in the closure, so one product delta @ closure per pass is enough.
+    # With delta set, matrix has to be closed already and delta holds pairs
+    # added to it. A new pair may then use closed pairs on both sides of the
+    # added ones, so the new pairs are extended on both sides.
+    matrix_format = getattr(matrix, "format", None)
+    if matrix_format not in ("csr", "csc"):
+        matrix, matrix_format = csr_matrix(matrix, dtype=bool), "csr"
+    closure = matrix.asformat(matrix_format).astype(bool)
+    with profiling.phase("closure") as timer:
+        if delta is None:
+            delta = closure
+            while delta.nnz > 0:
+                delta = (delta @ closure) > closure
+                closure = closure + delta
+                timer.iteration(closure)
+        else:
+            delta = csr_matrix(delta, dtype=bool).asformat(matrix_format) > closure
+            closure = closure + delta
+            while delta.nnz > 0:
+                delta = (delta @ closure + closure @ delta) > closure
+                closure = closure + delta
+                timer.iteration(closure)
+        timer.output(closure)
+    return closure
+
+
 def create_front(
     graph_smatrix: SparseMatrix,
     regex_smatrix: SparseMatrix,
     numerated_start_states: Dict,
-) -> dok_matrix:
-    front_row = dok_matrix((1, len(graph_smatrix.numerated_states)), dtype=bool)
-    front = dok_matrix(
+):
+    regex_states_count = len(regex_smatrix.numerated_states)
+    regex_start_states = [
+        regex_smatrix.numerated_states[i] for i in regex_smatrix.start_states
+    ]
+    graph_start_states = [regex_states_count + i for i in numerated_start_states]
+    rows = regex_start_states + [
+        i for i in regex_start_states for _ in graph_start_states
+    ]
+    cols = regex_start_states + graph_start_states * len(regex_start_states)
+    return matrix_backend.get_backend().from_coo(
+        rows,
+        cols,
         (
-            len(regex_smatrix.numerated_states),
-            len(graph_smatrix.numerated_states) + len(regex_smatrix.numerated_states),
+            regex_states_count,
+            len(graph_smatrix.numerated_states) + regex_states_count,
         ),
-        dtype=bool,
     )
-    for i in numerated_start_states:
-        front_row[0, i] = True
-    for i in regex_smatrix.start_states:
-        (
-            front[regex_smatrix.numerated_states[i], regex_smatrix.numerated_states[i]],
-            front[
-                regex_smatrix.numerated_states[i], len(regex_smatrix.numerated_states) :
-            ],
-        ) = (True, front_row)
-    return front
 
 
-def upd_front(regex_smatrix: SparseMatrix, front: dok_matrix) -> dok_matrix:
-    upd_front = dok_matrix(front.shape, dtype=bool)
+def upd_front(regex_smatrix: SparseMatrix, front: spmatrix) -> csr_matrix:
+    # Every row i with a nonempty graph part is moved, for each regex state j
+    # set in it, to row j of its block; all moves are done by one permutation
+    # product instead of per-row slicing.
     states_count = len(regex_smatrix.numerated_states)
-    for i, j in zip(*front.nonzero()):
-        if j < states_count and front[i, states_count:].count_nonzero() > 0:
-            upd_front[(i // states_count * states_count) + j, j] = True
-            upd_front[(i // states_count * states_count) + j, states_count:] += front[
-                i, states_count:
+    front = csr_matrix(front, dtype=bool)
+    front.eliminate_zeros()
+    graph_part = front[:, states_count:]
+    regex_part = front[:, :states_count].tocoo()
+
+    moved = np.diff(graph_part.indptr)[regex_part.row] > 0
+    rows_from = regex_part.row[moved]
+    regex_states = regex_part.col[moved]
+    rows_to = rows_from // states_count * states_count + regex_states
+    ones = np.ones(len(rows_to), dtype=bool)
+
+    permutation = csr_matrix(
+        (ones, (rows_to, rows_from)), shape=(front.shape[0], front.shape[0])
+    )
+    regex_diagonal = csr_matrix(
+        (ones, (rows_to, regex_states)), shape=(front.shape[0], states_count)
+    )
+    return hstack([regex_diagonal, permutation @ graph_part], format="csr")
+
+
+# Direct sum kept as its two diagonal blocks, used when the regex matrix is
+# bit-packed and cannot be put into a block_diag, or when the graph matrices
+# must not be copied, e.g. views of shared memory in worker processes.
+PackedDirectSum = namedtuple("PackedDirectSum", ["regex", "graph"])
+
+
+def direct_sum_step(front, ds_matrix, regex_states_count: int):
+    backend = matrix_backend.get_backend()
+    if not isinstance(ds_matrix, PackedDirectSum):
+        return backend.matmul(front, ds_matrix)
+    front = csr_matrix(front, dtype=bool)
+    if isinstance(ds_matrix.regex, PackedBoolMatrix):
+        regex_part = sparse_matmul_packed(
+            front[:, :regex_states_count], ds_matrix.regex
+        ).tocsr()
+    else:
+        regex_part = front[:, :regex_states_count] @ ds_matrix.regex
+    return backend.convert(
+        hstack(
+            [regex_part, front[:, regex_states_count:] @ ds_matrix.graph],
+            format="csr",
+        )
+    )
+
+
+def _packed_traversal(front, direct_sum: Dict, regex_states_count: int, timer):
+    # bfs traversal for packed regex matrices. The regex part of every front
+    # row r is either empty or just bit r % regex_states_count, so the front
+    # is kept as its graph part only. A step takes the regex states of row r
+    # from row r % regex_states_count of the packed matrix, nothing is
+    # converted to CSR and stacked on every step.
+    front = csr_matrix(front, dtype=bool)[:, regex_states_count:]
+    rows_count = front.shape[0]
+    row_states = np.arange(rows_count) % regex_states_count
+    block_starts = np.arange(rows_count) - row_states
+    attended = csr_matrix(front.shape, dtype=bool)
+    while True:
+        saved_nonzeros = attended.nnz
+        for ds_matrix in direct_sum.values():
+            next_graph = (attended if front is None else front) @ ds_matrix.graph
+            active = np.flatnonzero(np.diff(next_graph.indptr))
+            moved, regex_states = PackedBoolMatrix(
+                ds_matrix.regex.words[row_states[active]], regex_states_count
+            ).nonzero()
+            rows_from = active[moved]
+            permutation = csr_matrix(
+                (
+                    np.ones(len(rows_from), dtype=bool),
+                    (block_starts[rows_from] + regex_states, rows_from),
+                ),
+                shape=(rows_count, rows_count),
+            )
+            attended = attended + permutation @ next_graph
+        timer.iteration(attended)
+        if saved_nonzeros == attended.nnz:
+            break
+        front = None
+
+    active = np.flatnonzero(np.diff(attended.indptr))
+    regex_diagonal = csr_matrix(
+        (np.ones(len(active), dtype=bool), (active, row_states[active])),
+        shape=(rows_count, regex_states_count),
+    )
+    return hstack([regex_diagonal, attended], format="csr")
+
+
+def direct_sum_matrices(
+    graph_smatrix: SparseMatrix, regex_smatrix: SparseMatrix, split: bool = False
+) -> Dict:
+    # With split the graph matrices are kept as they are instead of being
+    # copied into a block_diag.
+    backend = matrix_backend.get_backend()
+    direct_sum = dict()
+    for i in set(graph_smatrix.matrix.keys()).intersection(
+        set(regex_smatrix.matrix.keys())
+    ):
+        if split or isinstance(regex_smatrix.matrix[i], PackedBoolMatrix):
+            regex_matrix = regex_smatrix.matrix[i]
+            if not isinstance(regex_matrix, PackedBoolMatrix):
+                regex_matrix = csr_matrix(regex_matrix, dtype=bool)
+            graph_matrix = graph_smatrix.matrix[i]
+            if not (
+                isinstance(graph_matrix, csr_matrix) and graph_matrix.dtype == bool
+            ):
+                graph_matrix = csr_matrix(graph_matrix, dtype=bool)
+            direct_sum[i] = PackedDirectSum(regex_matrix, graph_matrix)
+        else:
+            direct_sum[i] = backend.block_diag(
+                [regex_smatrix.matrix[i], graph_smatrix.matrix[i]]
+            )
+    return direct_sum
+
+
+def _empty_result(graph_smatrix: SparseMatrix, pairs: bool) -> RpqResult:
+    empty = np.zeros(0, dtype=np.int64)
+    return RpqResult(
+        graph_smatrix.inversed_numerated_states,
+        graph_smatrix.numerated_states,
+        empty,
+        empty if pairs else None,
+    )
+
+
+class PathWitnesses:
+    # Parent pointers of a level-synchronous product bfs, one row per start
+    # state with foreach_start_node and a single row otherwise. Only reached
+    # cells are stored: keys holds r * |Q| * |V| + q * |V| + v of every
+    # reached cell of row r in ascending order, parents the q' * |V| + u of
+    # the product state it was first reached from and labels the index of
+    # the symbol of that edge. Recording takes 20 bytes per reached cell.
+    def __init__(
+        self,
+        graph_smatrix: SparseMatrix,
+        regex_smatrix: SparseMatrix,
+        symbols: list,
+        numerated_start_states: list,
+        foreach_start_node: bool,
+        keys: np.ndarray,
+        parents: np.ndarray,
+        labels: np.ndarray,
+    ) -> None:
+        self.graph_smatrix = graph_smatrix
+        self.regex_smatrix = regex_smatrix
+        self.symbols = symbols
+        self.numerated_start_states = numerated_start_states
+        self.foreach_start_node = foreach_start_node
+        self.keys = keys
+        self.parents = parents
+        self.labels = labels
+        self._graph_states_count = len(graph_smatrix.numerated_states)
+        self._cells_count = (
+            len(regex_smatrix.numerated_states) * self._graph_states_count
+        )
+        self._regex_start_mask = _states_mask(regex_smatrix, regex_smatrix.start_states)
+        self._start_mask = np.zeros(self._graph_states_count, dtype=bool)
+        self._start_mask[numerated_start_states] = True
+        return
+
+    @property
+    def nbytes(self) -> int:
+        return self.keys.nbytes + self.parents.nbytes + self.labels.nbytes
+
+    def answers(self) -> RpqResult:
+        rows, cells = np.divmod(self.keys, max(self._cells_count, 1))
+        states, vertices = np.divmod(cells, self._graph_states_count)
+        accepted = (
+            _states_mask(self.regex_smatrix, self.regex_smatrix.final_states)[states]
+            & _states_mask(self.graph_smatrix, self.graph_smatrix.final_states)[
+                vertices
             ]
-    return upd_front
+        )
+        starts = (
+            np.array(self.numerated_start_states, dtype=np.int64)[rows[accepted]]
+            if self.foreach_start_node
+            else None
+        )
+        return RpqResult(
+            self.graph_smatrix.inversed_numerated_states,
+            self.graph_smatrix.numerated_states,
+            vertices[accepted],
+            starts,
+        )
+
+    def path(self, end, start=None) -> list:
+        # Shortest nonempty path to end as a list of (vertex, symbol, vertex)
+        # edges, from start with foreach_start_node and from any start otherwise.
+        graph_states_count = self._graph_states_count
+        if self.foreach_start_node:
+            start_index = self.graph_smatrix.numerated_states[start]
+            row = self.numerated_start_states.index(start_index)
+        else:
+            row = 0
+        end_index = self.graph_smatrix.numerated_states[end]
+
+        best = None
+        for state in self.regex_smatrix.final_states:
+            cell = (
+                self.regex_smatrix.numerated_states[state] * graph_states_count
+                + end_index
+            )
+            if self._find(row, cell) < 0:
+                continue
+            path = self._walk(
+                row, cell, start_index if self.foreach_start_node else None
+            )
+            if best is None or len(path) < len(best):
+                best = path
+        if best is None:
+            raise KeyError((start, end) if self.foreach_start_node else end)
+        return best
+
+    def _find(self, row: int, cell: int) -> int:
+        key = row * self._cells_count + cell
+        position = int(np.searchsorted(self.keys, key))
+        if position < len(self.keys) and self.keys[position] == key:
+            return position
+        return -1
+
+    def _walk(self, row: int, cell: int, start_index: int) -> list:
+        graph_states_count = self._graph_states_count
+        vertices = self.graph_smatrix.inversed_numerated_states
+        path = []
+        while True:
+            position = self._find(row, cell)
+            parent = int(self.parents[position])
+            path.append(
+                (
+                    vertices[parent % graph_states_count],
+                    self.symbols[self.labels[position]],
+                    vertices[cell % graph_states_count],
+                )
+            )
+            cell = parent
+            state, vertex = divmod(cell, graph_states_count)
+            if self._regex_start_mask[state] and (
+                vertex == start_index
+                if start_index is not None
+                else self._start_mask[vertex]
+            ):
+                break
+        path.reverse()
+        return path
+
+
+def _merge_runs(run1: Tuple, run2: Tuple) -> Tuple:
+    # Merges two (keys, parents, labels) runs with disjoint sorted keys.
+    keys, parents, labels = (np.concatenate(arrays) for arrays in zip(run1, run2))
+    order = np.argsort(keys, kind="stable")
+    return keys[order], parents[order], labels[order]
+
+
+def _in_runs(runs: list, keys: np.ndarray) -> np.ndarray:
+    found = np.zeros(len(keys), dtype=bool)
+    for run_keys, _, _ in runs:
+        positions = np.minimum(np.searchsorted(run_keys, keys), len(run_keys) - 1)
+        found |= run_keys[positions] == keys
+    return found
+
+
+def _expand_rows(matrix: csr_matrix, rows: np.ndarray) -> Tuple:
+    # Positions of the given rows in the matrix: for every stored entry of
+    # every row, the index into rows and the column of the entry.
+    counts = matrix.indptr[rows + 1] - matrix.indptr[rows]
+    owners = np.repeat(np.arange(len(rows)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owners, matrix.indices[matrix.indptr[rows][owners] + offsets]
+
+
+def witness_bfs(
+    graph_smatrix: SparseMatrix,
+    regex_smatrix: SparseMatrix,
+    foreach_start_node: bool = False,
+) -> PathWitnesses:
+    # Level-synchronous bfs over cells r * |Q| * |V| + q * |V| + v. All
+    # candidates of a level are collected before parents are assigned, so a
+    # cell keeps the parent of its first, i.e. shortest, visit. Every level
+    # adds a sorted run of reached cells, runs of similar size are merged, so
+    # there are O(log) runs to look a cell up in.
+    graph_states_count = len(graph_smatrix.numerated_states)
+    regex_states_count = len(regex_smatrix.numerated_states)
+    cells_count = regex_states_count * graph_states_count
+    numerated_start_states = [
+        graph_smatrix.numerated_states[s] for s in graph_smatrix.start_states
+    ]
+    rows_count = len(numerated_start_states) if foreach_start_node else 1
+    if rows_count * cells_count > np.iinfo(np.int64).max:
+        raise ValueError(
+            f"{rows_count} x {regex_states_count} x {graph_states_count} product "
+            "cells do not fit into int64"
+        )
+
+    symbols = list(graph_smatrix.matrix.keys() & regex_smatrix.matrix.keys())
+    transitions = []
+    for label, symbol in enumerate(symbols):
+        graph_matrix = csr_matrix(graph_smatrix.matrix[symbol], dtype=bool)
+        graph_matrix.eliminate_zeros()
+        for state_from, state_to in zip(*regex_smatrix.matrix[symbol].nonzero()):
+            transitions.append((int(state_from), int(state_to), label, graph_matrix))
+
+    start_rows = (
+        np.arange(len(numerated_start_states))
+        if foreach_start_node
+        else np.zeros(len(numerated_start_states), dtype=np.int64)
+    )
+    front = np.concatenate(
+        [
+            start_rows * cells_count
+            + regex_smatrix.numerated_states[state] * graph_states_count
+            + np.array(numerated_start_states, dtype=np.int64)
+            for state in regex_smatrix.start_states
+        ]
+        or [np.zeros(0, dtype=np.int64)]
+    ).astype(np.int64)
+    runs = []
+
+    with profiling.phase("witness_bfs") as timer:
+        while len(front):
+            timer.iteration()
+            rows, front_cells = np.divmod(front, cells_count)
+            states, vertices = np.divmod(front_cells, graph_states_count)
+            candidates, candidate_parents, candidate_labels = [], [], []
+            for state_from, state_to, label, graph_matrix in transitions:
+                selected = states == state_from
+                if not selected.any():
+                    continue
+                owners, vertices_to = _expand_rows(graph_matrix, vertices[selected])
+                candidates.append(
+                    rows[selected][owners] * cells_count
+                    + state_to * graph_states_count
+                    + vertices_to
+                )
+                candidate_parents.append(front_cells[selected][owners])
+                candidate_labels.append(np.full(len(owners), label, dtype=np.int32))
+            if not candidates:
+                break
+            candidates = np.concatenate(candidates)
+            fresh = ~_in_runs(runs, candidates)
+            front, first = np.unique(candidates[fresh], return_index=True)
+            if not len(front):
+                break
+            runs.append(
+                (
+                    front,
+                    np.concatenate(candidate_parents)[fresh][first],
+                    np.concatenate(candidate_labels)[fresh][first],
+                )
+            )
+            while len(runs) > 1 and len(runs[-2][0]) <= 2 * len(runs[-1][0]):
+                runs.append(_merge_runs(runs.pop(-2), runs.pop()))
+
+        while len(runs) > 1:
+            runs.append(_merge_runs(runs.pop(-2), runs.pop()))
+        keys, parents, labels = (
+            runs[0]
+            if runs
+            else (
+                np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.int32),
+            )
+        )
+        timer.output(keys)
+        timer.output(parents)
+        timer.output(labels)
+
+    return PathWitnesses(
+        graph_smatrix,
+        regex_smatrix,
+        symbols,
+        numerated_start_states,
+        foreach_start_node,
+        keys,
+        parents,
+        labels,
+    )
 
 
 def bfs(
     graph_smatrix: SparseMatrix,
     regex_smatrix: SparseMatrix,
     foreach_start_node: bool = False,
-) -> set:
+    direct_sum: Dict = None,
+    lazy_result: bool = False,
+    witnesses: bool = False,
+) -> Union[set, RpqResult, Tuple]:
+    # With lazy_result set, answers are returned as an RpqResult over index
+    # arrays instead of a set of vertices. With witnesses set, a pair of the
+    # answers and PathWitnesses is returned, see witness_bfs for the cost.
+    if witnesses:
+        witness = witness_bfs(graph_smatrix, regex_smatrix, foreach_start_node)
+        result = witness.answers()
+        return (result if lazy_result else set(result)), witness
     if not graph_smatrix.start_states:
-        return set()
+        return (
+            _empty_result(graph_smatrix, foreach_start_node) if lazy_result else set()
+        )
     numerated_start_states = [
         graph_smatrix.numerated_states[s] for s in graph_smatrix.start_states
     ]
-    if foreach_start_node:
-        front = vstack(
-            [
-                create_front(graph_smatrix, regex_smatrix, {i})
-                for i in numerated_start_states
+    with profiling.phase("bfs_front") as timer:
+        backend = matrix_backend.get_backend()
+        if foreach_start_node:
+            front = backend.vstack(
+                [
+                    create_front(graph_smatrix, regex_smatrix, {i})
+                    for i in numerated_start_states
+                ]
+            )
+        else:
+            front = create_front(graph_smatrix, regex_smatrix, numerated_start_states)
+
+        if direct_sum is None:
+            direct_sum = direct_sum_matrices(graph_smatrix, regex_smatrix)
+        timer.output(front)
+
+    with profiling.phase("bfs_traversal") as timer:
+        if direct_sum and all(
+            isinstance(ds_matrix, PackedDirectSum)
+            and isinstance(ds_matrix.regex, PackedBoolMatrix)
+            for ds_matrix in direct_sum.values()
+        ):
+            attended = _packed_traversal(
+                front, direct_sum, len(regex_smatrix.numerated_states), timer
+            )
+        else:
+            attended = backend.zeros(front.shape)
+            while True:
+                saved_nonzeros = backend.nnz(attended)
+                for ds_matrix in direct_sum.values():
+                    next_front = direct_sum_step(
+                        attended if front is None else front,
+                        ds_matrix,
+                        len(regex_smatrix.numerated_states),
+                    )
+                    attended = backend.add(
+                        attended,
+                        backend.convert(upd_front(regex_smatrix, next_front)),
+                    )
+                timer.iteration(attended)
+                if saved_nonzeros == backend.nnz(attended):
+                    break
+                front = None
+        timer.output(attended)
+
+    with profiling.phase("decode"):
+        regex_states_count = len(regex_smatrix.numerated_states)
+        rows, cols = attended.nonzero()
+        accepted = cols >= regex_states_count
+        rows, cols = rows[accepted], cols[accepted] - regex_states_count
+        accepted = (
+            _states_mask(regex_smatrix, regex_smatrix.final_states)[
+                rows % regex_states_count
             ]
+            & _states_mask(graph_smatrix, graph_smatrix.final_states)[cols]
         )
-    else:
-        front = create_front(graph_smatrix, regex_smatrix, numerated_start_states)
+        rows, cols = rows[accepted], cols[accepted]
+        starts = (
+            np.array(numerated_start_states, dtype=np.int64)[rows // regex_states_count]
+            if foreach_start_node
+            else None
+        )
+        result = RpqResult(
+            graph_smatrix.inversed_numerated_states,
+            graph_smatrix.numerated_states,
+            cols,
+            starts,
+        )
+        if not lazy_result:
+            result = set(result)
+    return result
 
-    direct_sum = dict()
-    for i in set(graph_smatrix.matrix.keys()).intersection(
-        set(regex_smatrix.matrix.keys())
-    ):
-        direct_sum[i] = dok_matrix(
-            block_diag((regex_smatrix.matrix[i], graph_smatrix.matrix[i]))
+
+def bfs_batches(
+    graph_smatrix: SparseMatrix,
+    regex_smatrix: SparseMatrix,
+    chunk_size: int,
+) -> Iterator[Tuple]:
+    # Runs the multi-source bfs on chunks of at most chunk_size start states,
+    # so the front never holds more than chunk_size blocks at once.
+    start_states = list(graph_smatrix.start_states)
+    direct_sum = direct_sum_matrices(graph_smatrix, regex_smatrix)
+    for i in range(0, len(start_states), chunk_size):
+        chunk_smatrix = graph_smatrix._replace(
+            start_states=set(start_states[i : i + chunk_size])
+        )
+        yield from bfs(
+            chunk_smatrix,
+            regex_smatrix,
+            foreach_start_node=True,
+            direct_sum=direct_sum,
         )
 
-    attended = dok_matrix(front.shape, dtype=bool)
-    while True:
-        saved_attended = attended.copy()
-        for ds_matrix in direct_sum.values():
-            next_front = attended @ ds_matrix if front is None else front @ ds_matrix
-            attended += upd_front(regex_smatrix, next_front)
-        if saved_attended.count_nonzero() == attended.count_nonzero():
-            break
-        front = None
+
+class ProductSearch:
+    # Traverses the product of the graph and the regex automaton without
+    # building kron(...): the front of every regex state is a (starts x |V|)
+    # matrix that is multiplied by the graph matrix of each outgoing symbol.
+    # Only product states reachable from the start states are ever expanded.
+    # visited holds the states reached by at least one step, every call of
+    # step() expands one level and returns its new (state, front) pairs.
+    def __init__(
+        self,
+        graph_smatrix: SparseMatrix,
+        regex_smatrix: SparseMatrix,
+        numerated_start_states: list,
+        foreach_start_node: bool = True,
+    ) -> None:
+        graph_states_count = len(graph_smatrix.numerated_states)
+        rows_count = len(numerated_start_states) if foreach_start_node else 1
+        self.start_front = csr_matrix(
+            (
+                np.ones(len(numerated_start_states), dtype=bool),
+                (
+                    np.arange(rows_count).repeat(
+                        1 if foreach_start_node else len(numerated_start_states)
+                    ),
+                    np.array(numerated_start_states, dtype=np.int64),
+                ),
+            ),
+            shape=(rows_count, graph_states_count),
+            dtype=bool,
+        )
+
+        self.transitions = dict()
+        self.graph_matrices = dict()
+        for symbol in graph_smatrix.matrix.keys() & regex_smatrix.matrix.keys():
+            self.graph_matrices[symbol] = csr_matrix(
+                graph_smatrix.matrix[symbol], dtype=bool
+            )
+            for state_from, state_to in zip(*regex_smatrix.matrix[symbol].nonzero()):
+                self.transitions.setdefault((state_from, symbol), []).append(state_to)
+
+        self.front = {
+            regex_smatrix.numerated_states[state]: self.start_front
+            for state in regex_smatrix.start_states
+        }
+        self.visited = dict()
+        return
+
+    def front_nnz(self) -> int:
+        return sum(front.nnz for front in self.front.values())
+
+    def step(self) -> Dict:
+        reached = dict()
+        for (state_from, symbol), states_to in self.transitions.items():
+            if state_from not in self.front:
+                continue
+            step = self.front[state_from] @ self.graph_matrices[symbol]
+            for state_to in states_to:
+                reached[state_to] = (
+                    reached[state_to] + step if state_to in reached else step
+                )
+
+        visited = self.visited
+        self.front = dict()
+        for state, step in reached.items():
+            new = step > visited[state] if state in visited else step
+            if new.nnz > 0:
+                visited[state] = visited[state] + new if state in visited else new
+                self.front[state] = new
+        return self.front
+
+
+def product_reachability(
+    graph_smatrix: SparseMatrix,
+    regex_smatrix: SparseMatrix,
+    numerated_start_states: list,
+    foreach_start_node: bool = True,
+    on_step: Callable[[int, csr_matrix], bool] = None,
+) -> Dict:
+    # Visited states of a ProductSearch run to the end. on_step sees every
+    # newly reached (state, front) pair, returning True from it stops the
+    # traversal.
+    search = ProductSearch(
+        graph_smatrix, regex_smatrix, numerated_start_states, foreach_start_node
+    )
+    with profiling.phase("product_traversal") as timer:
+        while search.front:
+            timer.iteration()
+            for state, new in search.step().items():
+                if on_step is not None and on_step(state, new):
+                    return search.visited
+    return search.visited
+
+
+def product_bfs(
+    graph_smatrix: SparseMatrix,
+    regex_smatrix: SparseMatrix,
+    foreach_start_node: bool = False,
+    limit: int = None,
+) -> set:
+    # With limit set, the traversal stops as soon as limit answers are found.
+    if not graph_smatrix.start_states or limit == 0:
+        return set()
+    numerated_start_states = [
+        graph_smatrix.numerated_states[s] for s in graph_smatrix.start_states
+    ]
+    final_mask = _states_mask(graph_smatrix, graph_smatrix.final_states)
+    regex_final_mask = _states_mask(regex_smatrix, regex_smatrix.final_states)
 
     ans = set()
-    graph_states_keys = list(graph_smatrix.numerated_states.keys())
-    regex_states_keys = list(regex_smatrix.numerated_states.keys())
-    regex_states_count = len(regex_smatrix.numerated_states)
-    for i, j in zip(*attended.nonzero()):
-        if (
-            regex_states_keys[i % regex_states_count] in regex_smatrix.final_states
-            and regex_states_count <= j
-        ):
-            if graph_states_keys[j - regex_states_count] in graph_smatrix.final_states:
-                if foreach_start_node:
-                    ans.add(
-                        (
-                            numerated_start_states[i // regex_states_count],
-                            j - regex_states_count,
-                        )
-                    )
-                else:
-                    ans.add(j - regex_states_count)
+
+    def collect(state: int, front: csr_matrix) -> bool:
+        if not regex_final_mask[state]:
+            return False
+        rows, cols = front.nonzero()
+        accepted = final_mask[cols]
+        for i, j in zip(rows[accepted], cols[accepted]):
+            end = graph_smatrix.inversed_numerated_states[j]
+            if foreach_start_node:
+                start = graph_smatrix.inversed_numerated_states[
+                    numerated_start_states[i]
+                ]
+                ans.add((start, end))
+            else:
+                ans.add(end)
+            if limit is not None and len(ans) >= limit:
+                return True
+        return False
+
+    product_reachability(
+        graph_smatrix,
+        regex_smatrix,
+        numerated_start_states,
+        foreach_start_node,
+        collect,
+    )
     return ans
+
+
+DIRECTIONS = ("forward", "reverse", "bidirectional")
+
+# Strategy picked for a query, log_costs holds the estimated natural log of
+# the work of every strategy that was considered.
+QueryPlan = namedtuple("QueryPlan", ["direction", "log_costs"])
+
+
+def reverse_sparse_matrix(sparse_matrix: SparseMatrix) -> SparseMatrix:
+    # Transposed matrices with start and final states swapped: it accepts
+    # the reversed words, over the reversed edges for a graph.
+    matrix = dict()
+    for symbol, symbol_matrix in sparse_matrix.matrix.items():
+        if isinstance(symbol_matrix, PackedBoolMatrix):
+            matrix[symbol] = PackedBoolMatrix.from_matrix(symbol_matrix.tocsr().T)
+        else:
+            matrix[symbol] = symbol_matrix.T
+    return sparse_matrix._replace(
+        start_states=sparse_matrix.final_states,
+        final_states=sparse_matrix.start_states,
+        matrix=matrix,
+    )
+
+
+def plan_direction(
+    graph_smatrix: SparseMatrix,
+    regex_smatrix: SparseMatrix,
+    foreach_start_node: bool = False,
+) -> QueryPlan:
+    # A search from k seeds whose first step follows labels of average degree
+    # d is taken to grow like k * (1 + d) ** h, h being the number of regex
+    # states. The forward search starts from the start vertices with the
+    # labels leaving the regex start states, the reverse one from the final
+    # vertices with the labels entering the regex final states. The
+    # bidirectional search pays two half-depth searches and a join of
+    # |starts| x |finals|. Without foreach_start_node the forward search is
+    # a single multi-source row, while the other two still keep a row per
+    # seed vertex.
+    backend = matrix_backend.get_backend()
+    vertices_count = max(len(graph_smatrix.numerated_states), 1)
+    depth = max(len(regex_smatrix.numerated_states), 1)
+
+    def growth(regex_states, outgoing: bool) -> float:
+        mask = _states_mask(regex_smatrix, regex_states)
+        edges = 0
+        for symbol, symbol_matrix in regex_smatrix.matrix.items():
+            states_from, states_to = symbol_matrix.nonzero()
+            if symbol in graph_smatrix.matrix and (
+                mask[states_from if outgoing else states_to].any()
+            ):
+                edges += backend.nnz(graph_smatrix.matrix[symbol])
+        return math.log1p(edges / vertices_count)
+
+    starts_log = math.log(max(len(graph_smatrix.start_states), 1))
+    finals_log = math.log(max(len(graph_smatrix.final_states), 1))
+    forward_seeds_log = starts_log if foreach_start_node else 0.0
+    forward_growth = growth(regex_smatrix.start_states, True)
+    reverse_growth = growth(regex_smatrix.final_states, False)
+    log_costs = {
+        "forward": forward_seeds_log + depth * forward_growth,
+        "reverse": finals_log + depth * reverse_growth,
+        "bidirectional": float(
+            np.logaddexp.reduce(
+                [
+                    starts_log + depth / 2 * forward_growth,
+                    finals_log + depth / 2 * reverse_growth,
+                    starts_log + finals_log,
+                ]
+            )
+        ),
+    }
+    return QueryPlan(min(log_costs, key=log_costs.get), log_costs)
+
+
+def _pairs_result(
+    graph_smatrix: SparseMatrix,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    foreach_start_node: bool,
+    lazy_result: bool,
+) -> Union[set, RpqResult]:
+    result = RpqResult(
+        graph_smatrix.inversed_numerated_states,
+        graph_smatrix.numerated_states,
+        ends,
+        starts if foreach_start_node else None,
+    )
+    return result if lazy_result else set(result)
+
+
+def reverse_bfs(
+    graph_smatrix: SparseMatrix,
+    regex_smatrix: SparseMatrix,
+    foreach_start_node: bool = False,
+    lazy_result: bool = False,
+) -> Union[set, RpqResult]:
+    # Same answers as bfs, found by searching from every final vertex over
+    # the reversed graph with the reversed regex automaton.
+    numerated_final_states = np.array(
+        [graph_smatrix.numerated_states[s] for s in graph_smatrix.final_states],
+        dtype=np.int64,
+    )
+    starts, ends = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    if len(numerated_final_states) and graph_smatrix.start_states:
+        visited = product_reachability(
+            reverse_sparse_matrix(graph_smatrix),
+            reverse_sparse_matrix(regex_smatrix),
+            numerated_final_states.tolist(),
+        )
+        start_mask = _states_mask(graph_smatrix, graph_smatrix.start_states)
+        regex_start_mask = _states_mask(regex_smatrix, regex_smatrix.start_states)
+        for state, reached in visited.items():
+            if not regex_start_mask[state]:
+                continue
+            rows, cols = reached.nonzero()
+            accepted = start_mask[cols]
+            starts.append(cols[accepted])
+            ends.append(numerated_final_states[rows[accepted]])
+    return _pairs_result(
+        graph_smatrix,
+        np.concatenate(starts),
+        np.concatenate(ends),
+        foreach_start_node,
+        lazy_result,
+    )
+
+
+def bidirectional_bfs(
+    graph_smatrix: SparseMatrix,
+    regex_smatrix: SparseMatrix,
+    foreach_start_node: bool = False,
+    lazy_result: bool = False,
+) -> Union[set, RpqResult]:
+    # Meet in the middle: a forward search from the start vertices and a
+    # reverse one from the final vertices, always expanding the smaller
+    # front, until one of them converges. A path of length L is then split
+    # at a product state reached in i >= 1 steps forward and L - i steps
+    # backward, so joining forward visited states with backward visited
+    # states plus the backward seeds gives every answer.
+    numerated_start_states = [
+        graph_smatrix.numerated_states[s] for s in graph_smatrix.start_states
+    ]
+    numerated_final_states = [
+        graph_smatrix.numerated_states[s] for s in graph_smatrix.final_states
+    ]
+    if not numerated_start_states or not numerated_final_states:
+        empty = np.zeros(0, dtype=np.int64)
+        return _pairs_result(
+            graph_smatrix, empty, empty, foreach_start_node, lazy_result
+        )
+
+    forward = ProductSearch(graph_smatrix, regex_smatrix, numerated_start_states)
+    backward = ProductSearch(
+        reverse_sparse_matrix(graph_smatrix),
+        reverse_sparse_matrix(regex_smatrix),
+        numerated_final_states,
+    )
+    with profiling.phase("bidirectional_traversal") as timer:
+        forward.step()
+        while forward.front and backward.front:
+            timer.iteration()
+            if forward.front_nnz() <= backward.front_nnz():
+                forward.step()
+            else:
+                backward.step()
+
+    with profiling.phase("decode"):
+        regex_final_mask = _states_mask(regex_smatrix, regex_smatrix.final_states)
+        pairs = csr_matrix(
+            (len(numerated_start_states), len(numerated_final_states)), dtype=bool
+        )
+        for state, reached in forward.visited.items():
+            met = backward.visited.get(state)
+            if regex_final_mask[state]:
+                met = (
+                    backward.start_front if met is None else met + backward.start_front
+                )
+            if met is not None:
+                pairs = pairs + reached @ met.T
+        rows, cols = pairs.nonzero()
+        return _pairs_result(
+            graph_smatrix,
+            np.array(numerated_start_states, dtype=np.int64)[rows],
+            np.array(numerated_final_states, dtype=np.int64)[cols],
+            foreach_start_node,
+            lazy_result,
+        )
+
+
+def tagged_union(regex_smatrices: list) -> Tuple[SparseMatrix, Dict]:
+    # Determinizes the union of several automata. A state is the frozenset of
+    # (query, state) pairs it stands for, so queries sharing a prefix share
+    # the states along it. Every final state is tagged with the queries that
+    # accept in it. Determinization is a product of the automata in the worst
+    # case, so once it yields more states than the automata have together,
+    # the union is built as their disjoint union instead: every state is a
+    # single pair, and the product traversal runs it as an NFA.
+    transitions = dict()
+    for query, regex_smatrix in enumerate(regex_smatrices):
+        for symbol, symbol_matrix in regex_smatrix.matrix.items():
+            for state_from, state_to in zip(*symbol_matrix.nonzero()):
+                transitions.setdefault(symbol, dict()).setdefault(
+                    (query, int(state_from)), []
+                ).append((query, int(state_to)))
+
+    start_pairs = [
+        (query, regex_smatrix.numerated_states[state])
+        for query, regex_smatrix in enumerate(regex_smatrices)
+        for state in regex_smatrix.start_states
+    ]
+    max_states_count = sum(
+        len(regex_smatrix.numerated_states) for regex_smatrix in regex_smatrices
+    )
+    start_state = frozenset(start_pairs)
+    start_states = {start_state}
+    numerated_states = {start_state: 0}
+    worklist = [start_state]
+    symbols = list(transitions.keys())
+    rows, cols, labels = [], [], []
+    while worklist and len(numerated_states) <= max_states_count:
+        state = worklist.pop()
+        for symbol_id, symbol in enumerate(symbols):
+            next_state = frozenset(
+                pair for part in state for pair in transitions[symbol].get(part, ())
+            )
+            if not next_state:
+                continue
+            if next_state not in numerated_states:
+                numerated_states[next_state] = len(numerated_states)
+                worklist.append(next_state)
+            rows.append(numerated_states[state])
+            cols.append(numerated_states[next_state])
+            labels.append(symbol_id)
+
+    if len(numerated_states) > max_states_count:
+        pairs = [
+            (query, part)
+            for query, regex_smatrix in enumerate(regex_smatrices)
+            for part in range(len(regex_smatrix.numerated_states))
+        ]
+        numerated_states = {frozenset({pair}): i for i, pair in enumerate(pairs)}
+        start_states = {frozenset({pair}) for pair in start_pairs}
+        rows, cols, labels = [], [], []
+        for symbol_id, symbol in enumerate(symbols):
+            for pair_from, pairs_to in transitions[symbol].items():
+                for pair_to in pairs_to:
+                    rows.append(numerated_states[frozenset({pair_from})])
+                    cols.append(numerated_states[frozenset({pair_to})])
+                    labels.append(symbol_id)
+
+    tags = dict()
+    for state, number in numerated_states.items():
+        accepted = {
+            query
+            for query, part in state
+            if regex_smatrices[query].inversed_numerated_states[part]
+            in regex_smatrices[query].final_states
+        }
+        if accepted:
+            tags[number] = accepted
+
+    matrix = coo_to_bool_matrices(
+        np.array(rows, dtype=np.int64),
+        np.array(cols, dtype=np.int64),
+        np.array(labels, dtype=np.int64),
+        symbols,
+        len(numerated_states),
+    )
+    union = SparseMatrix(
+        numerated_states,
+        {number: state for state, number in numerated_states.items()},
+        start_states,
+        {state for state, number in numerated_states.items() if number in tags},
+        matrix,
+    )
+    return union, tags
+
+
+def compare_backends(
+    graph_smatrix: SparseMatrix,
+    regex_smatrix: SparseMatrix,
+    foreach_start_node: bool = False,
+    backends: list = None,
+    baseline: str = "dok",
+) -> Dict:
+    # Runs the same bfs on every backend and reports its time and the speedup
+    # over the baseline backend. Answers have to agree between backends.
+    backends = backends or list(matrix_backend.BACKENDS)
+    if baseline not in backends:
+        backends = [baseline] + backends
+
+    report = dict()
+    expected = None
+    for name in backends:
+        with matrix_backend.use_backend(name) as backend:
+            graph = graph_smatrix._replace(
+                matrix=matrix_backend.convert_matrices(graph_smatrix.matrix, backend)
+            )
+            regex = regex_smatrix._replace(
+                matrix=matrix_backend.convert_matrices(regex_smatrix.matrix, backend)
+            )
+            if backend.pack_regex:
+                regex = pack_sparse_matrix(regex)
+            start = perf_counter()
+            ans = bfs(graph, regex, foreach_start_node)
+            report[name] = {"time": perf_counter() - start}
+        if expected is None:
+            expected = ans
+        elif expected != ans:
+            raise AssertionError(f"Backend {name} disagrees with {backends[0]}")
+
+    for name in backends:
+        report[name]["speedup"] = report[baseline]["time"] / max(
+            report[name]["time"], 1e-9
+        )
+    return report
@@ -0,0 +1,180 @@
+import json
+import os
+from collections.abc import Mapping, Set
+import numpy as np
+from scipy.sparse import csr_matrix
+from typing import Callable
+from project.sparse_matrix_utils import SparseMatrix
+
+
+MANIFEST_FILE = "manifest.json"
+NODES_FILE = "nodes.npy"
+SYMBOLS_FILE = "symbols.npy"
+START_STATES_FILE = "start_states.npy"
+FINAL_STATES_FILE = "final_states.npy"
+
+
+def _to_python(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class LazyMapping(Mapping):
+    # Builds the underlying dict on first access only, len() is known upfront.
+    def __init__(self, build: Callable[[], dict], size: int) -> None:
+        self._build = build
+        self._size = size
+        self._data = None
+        return
+
+    def _get(self) -> dict:
+        if self._data is None:
+            self._data = self._build()
+        return self._data
+
+    def __getitem__(self, key):
+        return self._get()[key]
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class NodeIndex(Mapping):
+    # Maps matrix indices to vertices by reading the (memory-mapped) node array.
+    def __init__(self, nodes: np.ndarray) -> None:
+        self._nodes = nodes
+        return
+
+    def __getitem__(self, index: int):
+        if not 0 <= index < len(self._nodes):
+            raise KeyError(index)
+        return _to_python(self._nodes[index])
+
+    def __iter__(self):
+        return iter(range(len(self._nodes)))
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+
+class LazyStateSet(Set):
+    # Set of vertices stored as an index array, materialized on first lookup.
+    def __init__(self, indices: np.ndarray, nodes: np.ndarray) -> None:
+        self._indices = indices
+        self._nodes = nodes
+        self._data = None
+        return
+
+    def _get(self) -> set:
+        if self._data is None:
+            self._data = {_to_python(self._nodes[i]) for i in self._indices}
+        return self._data
+
+    def __contains__(self, state) -> bool:
+        return state in self._get()
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __len__(self) -> int:
+        return len(self._indices)
+
+
+def _states_to_indices(sparse_matrix: SparseMatrix, states) -> np.ndarray:
+    return np.array(
+        sorted(sparse_matrix.numerated_states[state] for state in states),
+        dtype=np.int64,
+    )
+
+
+def _values_array(values: list) -> np.ndarray:
+    # A typed array only for values of one type, np.array would silently
+    # turn e.g. mixed ints and strings into strings.
+    array = None
+    if len({type(value) for value in values}) == 1:
+        array = np.array(values)
+    if (
+        array is None
+        or array.dtype.kind not in "biufU"
+        or array.shape != (len(values),)
+    ):
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+    return array
+
+
+def save_sparse_matrix(sparse_matrix: SparseMatrix, path: str) -> None:
+    # Layout: manifest.json with sizes, nodes.npy with the vertex of every
+    # index, symbols.npy with the symbol of every matrix, start/final index
+    # arrays and data/indices/indptr arrays of every symbol matrix. Plain
+    # .npy files can be loaded memory-mapped.
+    os.makedirs(path, exist_ok=True)
+    states_count = len(sparse_matrix.numerated_states)
+    nodes = [sparse_matrix.inversed_numerated_states[i] for i in range(states_count)]
+    np.save(os.path.join(path, NODES_FILE), _values_array(nodes), allow_pickle=True)
+    np.save(
+        os.path.join(path, SYMBOLS_FILE),
+        _values_array(list(sparse_matrix.matrix.keys())),
+        allow_pickle=True,
+    )
+    np.save(
+        os.path.join(path, START_STATES_FILE),
+        _states_to_indices(sparse_matrix, sparse_matrix.start_states),
+    )
+    np.save(
+        os.path.join(path, FINAL_STATES_FILE),
+        _states_to_indices(sparse_matrix, sparse_matrix.final_states),
+    )
+
+    for i, symbol_matrix in enumerate(sparse_matrix.matrix.values()):
+        symbol_matrix = csr_matrix(symbol_matrix, dtype=bool)
+        symbol_matrix.sort_indices()
+        for name in ("data", "indices", "indptr"):
+            np.save(
+                os.path.join(path, f"symbol_{i}_{name}.npy"),
+                getattr(symbol_matrix, name),
+            )
+
+    with open(os.path.join(path, MANIFEST_FILE), "w") as manifest:
+        json.dump({"states_count": states_count}, manifest)
+    return
+
+
+def load_sparse_matrix(path: str, mmap: bool = True) -> SparseMatrix:
+    with open(os.path.join(path, MANIFEST_FILE)) as manifest:
+        manifest = json.load(manifest)
+    states_count = manifest["states_count"]
+    mmap_mode = "r" if mmap else None
+
+    def load(name: str) -> np.ndarray:
+        return np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+
+    try:
+        nodes = load(NODES_FILE)
+    except ValueError:
+        # Object arrays cannot be memory-mapped and are read as a whole.
+        nodes = np.load(os.path.join(path, NODES_FILE), allow_pickle=True)
+
+    symbols = np.load(os.path.join(path, SYMBOLS_FILE), allow_pickle=True)
+    matrix = dict()
+    for i, symbol in enumerate(symbols.tolist()):
+        matrix[symbol] = csr_matrix(
+            tuple(
+                load(f"symbol_{i}_{name}.npy") for name in ("data", "indices", "indptr")
+            ),
+            shape=(states_count, states_count),
+            copy=False,
+        )
+
+    return SparseMatrix(
+        LazyMapping(
+            lambda: {_to_python(node): i for i, node in enumerate(nodes)},
+            states_count,
+        ),
+        NodeIndex(nodes),
+        LazyStateSet(load(START_STATES_FILE), nodes),
+        LazyStateSet(load(FINAL_STATES_FILE), nodes),
+        matrix,
+    )
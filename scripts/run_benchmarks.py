@@ -0,0 +1,236 @@
+import argparse
+import csv
+import json
+import random
+import sys
+import tracemalloc
+from time import perf_counter
+import networkx as nx
+import shared
+
+sys.path.insert(0, str(shared.ROOT))
+
+import project.automaton_utils as automaton_utils  # noqa: E402
+import project.graph_utils as graph_utils  # noqa: E402
+import project.sparse_matrix_utils as sparse_matrix_utils  # noqa: E402
+
+
+REGEXES = ["a*", "a* b", "(a | b)*", "a b* a", "(a b)* | b+", "a (b | c)* d"]
+GRAMMARS = ["S -> a S b | a b", "S -> a S b S | $"]
+FIELDS = [
+    "graph",
+    "nodes",
+    "edges",
+    "query",
+    "phase",
+    "seconds",
+    "peak_bytes",
+    "answers",
+]
+
+
+def scale_free_graph(size: int, labels: tuple, seed: int) -> nx.MultiDiGraph:
+    # Directed scale-free graph with edge labels drawn uniformly from labels,
+    # generated locally so that runs never need the network.
+    rng = random.Random(seed)
+    graph = nx.MultiDiGraph(nx.scale_free_graph(size, seed=seed))
+    for _, _, data in graph.edges(data=True):
+        data["label"] = rng.choice(labels)
+    return graph
+
+
+def generate_graphs(sizes: list, seed: int) -> list:
+    graphs = []
+    for size in sizes:
+        graphs.append(
+            (
+                f"two_cycles_{size}",
+                graph_utils.get_labeled_two_cycles_graph(size, size, labels=("a", "b")),
+            )
+        )
+        graphs.append(
+            (f"scale_free_{size}", scale_free_graph(size, ("a", "b", "c", "d"), seed))
+        )
+    return graphs
+
+
+def measure(run, repeat: int) -> tuple:
+    # Best wall time of repeat runs, then one more run under tracemalloc for
+    # the peak memory, so that tracing does not distort the timings.
+    seconds = float("inf")
+    for _ in range(repeat):
+        begin = perf_counter()
+        result = run()
+        seconds = min(seconds, perf_counter() - begin)
+    tracemalloc.start()
+    try:
+        run()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak_bytes
+
+
+def benchmark_rpq(
+    graph,
+    regex: str,
+    start_states: set,
+    final_states: set,
+    repeat: int,
+    full_product: bool,
+) -> list:
+    rows = []
+
+    def record(phase: str, run, answers=None):
+        result, seconds, peak_bytes = measure(run, repeat)
+        rows.append(
+            {
+                "query": regex,
+                "phase": phase,
+                "seconds": seconds,
+                "peak_bytes": peak_bytes,
+                "answers": answers(result) if answers else None,
+            }
+        )
+        return result
+
+    graph_smatrix = record(
+        "graph_to_matrix", lambda: automaton_utils.graph_to_sparse_matrix(graph)
+    )
+    regex_smatrix = automaton_utils.compile_regex(regex).sparse_matrix
+    # The Kronecker product and its closure grow with |V| ** 2 on dense
+    # answers, so they only run on graphs up to --closure-max-size nodes.
+    if full_product:
+        compact_graph = sparse_matrix_utils.to_compact(graph_smatrix)
+        compact_regex = sparse_matrix_utils.to_compact(regex_smatrix)
+        intersection = record(
+            "intersect",
+            lambda: sparse_matrix_utils.compact_intersect(compact_graph, compact_regex),
+        )
+        if intersection.matrix:
+            adjacency = sum(intersection.matrix.values())
+            record(
+                "closure",
+                lambda: sparse_matrix_utils.transitive_closure(adjacency),
+                lambda closure: closure.nnz,
+            )
+        record("rpq", lambda: automaton_utils.rpq(graph, regex), len)
+    record(
+        "rpq_lazy_product",
+        lambda: automaton_utils.rpq(graph, regex, start_states, lazy_product=True),
+        len,
+    )
+    record(
+        "bfs",
+        lambda: sparse_matrix_utils.bfs(graph_smatrix, regex_smatrix),
+        len,
+    )
+    record(
+        "bfs_foreach",
+        lambda: sparse_matrix_utils.bfs(
+            graph_smatrix._replace(start_states=start_states),
+            regex_smatrix,
+            foreach_start_node=True,
+        ),
+        len,
+    )
+    for direction in ("auto",) + sparse_matrix_utils.DIRECTIONS:
+        record(
+            f"bfs_rpq_{direction}",
+            lambda: automaton_utils.bfs_rpq(
+                graph,
+                regex,
+                start_states,
+                final_states,
+                foreach_start_node=True,
+                direction=direction,
+            ),
+            len,
+        )
+    return rows
+
+
+def benchmark_cfpq(graph, grammar: str, repeat: int) -> list:
+    rows = []
+    for algorithm, engine in automaton_utils.CFPQ_ALGORITHMS.items():
+        result, seconds, peak_bytes = measure(lambda: engine(graph, grammar), repeat)
+        rows.append(
+            {
+                "query": grammar,
+                "phase": f"cfpq_{algorithm}",
+                "seconds": seconds,
+                "peak_bytes": peak_bytes,
+                "answers": len(result),
+            }
+        )
+    return rows
+
+
+def write_results(rows: list, output: str) -> None:
+    with open(f"{output}.json", "w") as file:
+        json.dump(rows, file, indent=2)
+    with open(f"{output}.csv", "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the path query engines")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 300, 1000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--starts", type=int, default=16)
+    parser.add_argument("--finals", type=int, default=16)
+    parser.add_argument(
+        "--closure-max-size",
+        type=int,
+        default=300,
+        help="run the full product, its closure and rpq on graphs up to this "
+        "many nodes",
+    )
+    parser.add_argument(
+        "--cfpq-max-size",
+        type=int,
+        default=300,
+        help="run the CFPQ engines on graphs up to this many nodes",
+    )
+    parser.add_argument("--output", default="benchmark_results")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rows = []
+    for name, graph in generate_graphs(args.sizes, args.seed):
+        nodes = list(graph.nodes)
+        start_states = set(rng.sample(nodes, min(args.starts, len(nodes))))
+        final_states = set(rng.sample(nodes, min(args.finals, len(nodes))))
+        graph_rows = []
+        for regex in REGEXES:
+            graph_rows += benchmark_rpq(
+                graph,
+                regex,
+                start_states,
+                final_states,
+                args.repeat,
+                graph.number_of_nodes() <= args.closure_max_size,
+            )
+        if graph.number_of_nodes() <= args.cfpq_max_size:
+            for grammar in GRAMMARS:
+                graph_rows += benchmark_cfpq(graph, grammar, args.repeat)
+        for row in graph_rows:
+            row.update(
+                graph=name,
+                nodes=graph.number_of_nodes(),
+                edges=graph.number_of_edges(),
+            )
+            print(
+                f"{name} {row['query']!r} {row['phase']}: "
+                f"{row['seconds']:.4f}s, {row['peak_bytes']} bytes"
+            )
+        rows += graph_rows
+
+    write_results(rows, args.output)
+
+
+if __name__ == "__main__":
+    main()
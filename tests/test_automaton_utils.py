@@ -3,6 +3,8 @@ import cfpq_data as cd
 import networkx as nx
 import project.automaton_utils as utils
 import project.graph_utils as graph_utils
+import project.sparse_matrix_utils as sparse_matrix_utils
+import pytest
 from pyformlang.regular_expression import Regex
 from pyformlang.finite_automaton import DeterministicFiniteAutomaton as DFA, State
 
@@ -253,3 +255,203 @@ def test_bfs_rpq_10() -> None:
     graph = cd.graph_from_csv(cd.download("travel"))
     regex = Regex("range")
     assert 0 < len(utils.bfs_rpq(graph, regex, foreach_start_node=True))
+
+
+def test_graph_to_sparse_matrix() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(5, 100, labels=("x", "y"))
+    graph.add_node("isolated")
+    expected = sparse_matrix_utils.nfa_to_sparse_matrix(
+        utils.graph_to_nfa(graph, start_nodes={0})
+    )
+    actual = utils.graph_to_sparse_matrix(graph, start_nodes={0, "missing"})
+
+    assert {0} == actual.start_states
+    assert set(graph.nodes) == actual.final_states
+    assert expected.matrix.keys() == actual.matrix.keys()
+    for symbol, symbol_matrix in actual.matrix.items():
+        edges = {
+            (actual.inversed_numerated_states[i], actual.inversed_numerated_states[j])
+            for i, j in zip(*symbol_matrix.nonzero())
+        }
+        expected_edges = {
+            (
+                expected.inversed_numerated_states[i],
+                expected.inversed_numerated_states[j],
+            )
+            for i, j in zip(*expected.matrix[symbol].nonzero())
+        }
+        assert expected_edges == edges
+
+
+def test_rpq_lazy_product() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(20, 30, labels=("a", "b"))
+    for regex in [Regex("a*b"), Regex("(a+b)*b"), Regex("a a a"), Regex("c")]:
+        for start_states in [None, {0}, {3, 25}]:
+            assert utils.rpq(graph, regex, start_states) == utils.rpq(
+                graph, regex, start_states, lazy_product=True
+            )
+
+
+def test_bfs_rpq_batches() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(20, 20, labels=("g", "h"))
+    regex = Regex("(g*)+h")
+    expected = utils.bfs_rpq(graph, regex, foreach_start_node=True)
+    for chunk_size in [1, 7, 1000]:
+        batches = utils.bfs_rpq_batches(graph, regex, chunk_size=chunk_size)
+        assert expected == set(batches)
+    assert {(10, x) for x in range(0, 21)} == set(
+        utils.bfs_rpq_batches(graph, regex, start_states={10}, chunk_size=3)
+    )
+
+
+def test_regex_cache() -> None:
+    cache = utils.RegexCache(maxsize=2)
+    first = cache.get("a*b")
+    assert first is cache.get("a*b")
+    assert first.dfa.is_equivalent_to(utils.regex_to_min_dfa(Regex("a*b")))
+    assert {"a", "b"} == set(first.sparse_matrix.matrix.keys())
+
+    cache.get(Regex("c"))
+    cache.get("d")
+    assert {"hits": 1, "misses": 3, "size": 2, "maxsize": 2} == cache.stats()
+    assert first is not cache.get("a*b")
+
+    cache.resize(0)
+    assert 0 == cache.stats()["size"]
+
+
+def test_rpq_accepts_regex_text() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(5, 5, labels=("x", "y"))
+    assert utils.bfs_rpq(graph, Regex("(x)(y)")) == utils.bfs_rpq(graph, "x y")
+
+
+def test_rpq_batch() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(8, 6, labels=("a", "b"))
+    regexes = ["a* b", "a* b b", Regex("a a"), "(a+b)* b", "c", "a* b"]
+    for start_states, final_states in [(None, None), ({0, 3}, {0, 1, 9})]:
+        expected = [
+            utils.rpq(graph, regex, start_states, final_states) for regex in regexes
+        ]
+        assert expected == utils.rpq_batch(graph, regexes, start_states, final_states)
+    assert [] == utils.rpq_batch(graph, [])
+
+
+def test_tagged_union_shares_prefixes() -> None:
+    union, tags = sparse_matrix_utils.tagged_union(
+        [utils.compile_regex(regex).sparse_matrix for regex in ["a b c", "a b d"]]
+    )
+    # a, b are shared, c and d end in different tagged states.
+    assert 5 == len(union.numerated_states)
+    assert [{0}, {1}] == sorted(tags.values(), key=min)
+
+
+def test_tagged_union_falls_back_to_disjoint_union() -> None:
+    # Determinizing modular queries builds their product, 2310 states here.
+    regexes = [f"({' '.join(['a'] * n)})*" for n in [2, 3, 5, 7, 11]]
+    regex_smatrices = [utils.compile_regex(regex).sparse_matrix for regex in regexes]
+    union, tags = sparse_matrix_utils.tagged_union(regex_smatrices)
+    assert sum(len(r.numerated_states) for r in regex_smatrices) == len(
+        union.numerated_states
+    )
+    assert len(regexes) == len(union.start_states)
+
+    graph = graph_utils.get_labeled_two_cycles_graph(20, 13, labels=("a", "a"))
+    assert [utils.rpq(graph, regex) for regex in regexes] == utils.rpq_batch(
+        graph, regexes
+    )
+
+
+def test_rpq_exists_and_limit() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(30, 30, labels=("a", "b"))
+    full = utils.rpq(graph, "a* b")
+    limited = utils.rpq(graph, "a* b", limit=5)
+
+    assert 5 == len(limited) and limited <= full
+    assert full == utils.rpq(graph, "a* b", limit=len(full) + 1)
+    assert utils.rpq(graph, "a* b", exists=True)
+    assert not utils.rpq(graph, "a b a b b", exists=True)
+    assert set() == utils.rpq(graph, "a* b", limit=0)
+
+
+def test_bfs_rpq_exists_and_limit() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(30, 30, labels=("a", "b"))
+    for foreach_start_node in [True, False]:
+        full = utils.bfs_rpq(graph, "a* b", foreach_start_node=foreach_start_node)
+        limited = utils.bfs_rpq(
+            graph, "a* b", foreach_start_node=foreach_start_node, limit=3
+        )
+        assert 3 == len(limited) and limited <= full
+    assert utils.bfs_rpq(graph, "b", start_states={0}, exists=True)
+    assert not utils.bfs_rpq(graph, "b", start_states={5}, exists=True)
+    assert 2 == len(utils.bfs_rpq(graph, "$", limit=2))
+
+
+def test_matrix_cfpq() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(2, 1, labels=("a", "b"))
+    triples = utils.matrix_cfpq(graph, "S -> a S b | a b")
+    assert {(u, v) for u, variable, v in triples if variable == "S"} == {
+        (0, 0),
+        (0, 3),
+        (1, 0),
+        (1, 3),
+        (2, 0),
+        (2, 3),
+    }
+    assert utils.cfpq(graph, "S -> a S b | a b", {1}, {3}) == {(1, 3)}
+    with pytest.raises(ValueError):
+        utils.cfpq(graph, "S -> a", algorithm="unknown")
+
+
+def test_tensor_cfpq_matches_matrix_cfpq() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+    for grammar in (
+        "S -> a S b | a b",
+        "S -> a S b S | $",
+        "S -> A B\nA -> a A | a\nB -> b",
+    ):
+        for algorithm in ("matrix", "tensor"):
+            assert utils.cfpq(graph, grammar, algorithm=algorithm) == utils.cfpq(
+                graph, grammar
+            )
+    assert (0, "S", 4) in utils.tensor_cfpq(graph, "S -> a* b")
+
+
+def test_hellings_cfpq_matches_matrix_cfpq() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+    graph.add_edge(4, 4, label="a")
+    for grammar in ("S -> a S b | a b", "S -> a S b S | $", "S -> S S | a | b"):
+        assert utils.hellings_cfpq(graph, grammar) == utils.matrix_cfpq(graph, grammar)
+
+
+def test_plan_graph_matrix_prunes_labels_and_vertices() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+    graph.add_edges_from([(6, 7, {"label": "c"}), (8, 4, {"label": "a"})])
+    regex_smatrix = utils.compile_regex("a* b").sparse_matrix
+    graph_smatrix = utils.plan_graph_matrix(graph, regex_smatrix, {1, 6}, None)
+    assert set(graph_smatrix.matrix) == {"a", "b"}
+    assert set(graph_smatrix.numerated_states) == {0, 1, 2, 3, 4, 5}
+    assert utils.rpq(graph, "a* b", {1, 6}) == {(1, 4)}
+
+
+def test_bfs_rpq_direction() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(5, 3, labels=("a", "b"))
+    expected = utils.bfs_rpq(graph, "a* b", None, {6}, True, direction="forward")
+    ans, plan = utils.bfs_rpq(graph, "a* b", None, {6}, True, return_plan=True)
+    assert ans == expected and plan.direction == "reverse"
+    for direction in ("reverse", "bidirectional"):
+        assert expected == utils.bfs_rpq(
+            graph, "a* b", None, {6}, True, direction=direction
+        )
+    with pytest.raises(ValueError):
+        utils.bfs_rpq(graph, "a* b", direction="sideways")
+
+
+def test_bfs_rpq_auto_keeps_multi_source_forward() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(40, 30, labels=("a", "b"))
+    final_states = set(range(30))
+    for regex in ["(a | b)* b", "a (a | b)*"]:
+        ans, plan = utils.bfs_rpq(graph, regex, None, final_states, return_plan=True)
+        assert plan.direction == "forward"
+        assert ans == utils.bfs_rpq(
+            graph, regex, None, final_states, direction="reverse"
+        )
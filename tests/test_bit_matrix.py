@@ -0,0 +1,83 @@
+import numpy as np
+import project.automaton_utils as automaton_utils
+import project.graph_utils as graph_utils
+from project.bit_matrix import (
+    PackedBoolMatrix,
+    sparse_kron_packed,
+    sparse_matmul_packed,
+)
+from pyformlang.regular_expression import Regex
+from scipy.sparse import kron, random
+
+
+def random_bool_matrix(shape, seed):
+    return random(*shape, density=0.2, random_state=seed, format="csr") > 0
+
+
+def test_packed_round_trip() -> None:
+    for cols in [1, 63, 64, 65, 130]:
+        matrix = random_bool_matrix((7, cols), cols)
+        packed = PackedBoolMatrix.from_matrix(matrix)
+
+        assert (7, cols) == packed.shape
+        assert (matrix.toarray() == packed.toarray()).all()
+        assert matrix.count_nonzero() == packed.count_nonzero()
+        assert 0 == (matrix != packed.tocsr()).nnz
+    assert (0, 5) == PackedBoolMatrix.zeros((0, 5)).toarray().shape
+
+
+def test_packed_matmul() -> None:
+    left = random_bool_matrix((9, 70), 1)
+    right = random_bool_matrix((70, 66), 2)
+    expected = (left @ right).toarray()
+
+    packed_product = PackedBoolMatrix.from_matrix(left) @ PackedBoolMatrix.from_matrix(
+        right
+    )
+    mixed_product = sparse_matmul_packed(left, PackedBoolMatrix.from_matrix(right))
+
+    assert (expected == packed_product.toarray()).all()
+    assert (expected == mixed_product.toarray()).all()
+
+
+def test_sparse_matmul_packed_with_empty_rows() -> None:
+    left = random_bool_matrix((5, 4), 3).tolil()
+    left[0, :] = False
+    left[4, :] = False
+    right = random_bool_matrix((4, 3), 4)
+
+    assert (
+        (left @ right).toarray()
+        == sparse_matmul_packed(left, PackedBoolMatrix.from_matrix(right)).toarray()
+    ).all()
+
+
+def test_sparse_kron_packed() -> None:
+    left = random_bool_matrix((6, 6), 5)
+    right = random_bool_matrix((3, 3), 6)
+
+    assert (
+        0
+        == (
+            kron(left, right, format="csr")
+            != sparse_kron_packed(left, PackedBoolMatrix.from_matrix(right))
+        ).nnz
+    )
+
+
+def test_rpq_with_packed_regex() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(12, 9, labels=("a", "b"))
+    for regex in [Regex("a*b"), Regex("(a+b)* b b"), Regex("c")]:
+        assert automaton_utils.rpq(graph, regex) == automaton_utils.rpq(
+            graph, regex, packed_regex=True
+        )
+        for foreach_start_node in [True, False]:
+            assert automaton_utils.bfs_rpq(
+                graph, regex, foreach_start_node=foreach_start_node
+            ) == automaton_utils.bfs_rpq(
+                graph,
+                regex,
+                foreach_start_node=foreach_start_node,
+                packed_regex=True,
+            )
+    assert np.uint64 == PackedBoolMatrix.zeros((2, 2)).words.dtype
@@ -0,0 +1,31 @@
+from itertools import product
+import project.cfg_utils as cfg_utils
+import pytest
+from pyformlang.cfg import CFG
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "S -> a S b S | $",
+        "S -> A B\nA -> a A | a\nB -> b | $",
+        "S -> A\nA -> a | $",
+        "S -> a S b a b | b b A a\nA -> a A b | $",
+    ],
+)
+def test_cfg_to_wcnf(text) -> None:
+    cfg = CFG.from_text(text)
+    wcnf = cfg_utils.cfg_to_wcnf(text)
+    for production in wcnf.productions:
+        assert len(production.body) <= 2
+        if len(production.body) == 2:
+            assert all(symbol in wcnf.variables for symbol in production.body)
+    for length in range(5):
+        for word in product("ab", repeat=length):
+            assert wcnf.contains(word) == cfg.contains(word)
+
+
+def test_read_cfg(tmp_path) -> None:
+    (tmp_path / "grammar.txt").write_text("S -> a S | $")
+    cfg = cfg_utils.read_cfg(tmp_path / "grammar.txt")
+    assert cfg.contains("aa") and not cfg.contains("b")
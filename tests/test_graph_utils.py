@@ -1,4 +1,5 @@
 import os
+import project.automaton_utils as automaton_utils
 import project.graph_utils as utils
 import cfpq_data as cd
 from filecmp import cmp
@@ -51,3 +52,49 @@ def test_save_graph_dot() -> None:
         assert cmp(expected_graph_path, graph_path, shallow=False)
     finally:
         os.remove(graph_path)
+
+
+def test_read_graph_csv_matrices(tmp_path) -> None:
+    graph = cd.labeled_two_cycles_graph(5, 7, labels=("x", "y"))
+    graph.add_edge(3, 3, label="x")
+    graph.add_edge(3, 3, label="z")
+    path = cd.graph_to_csv(graph, tmp_path / "graph.csv")
+    expected_graph = cd.graph_from_csv(path)
+    expected_info = utils.GraphData(expected_graph)
+    expected = automaton_utils.graph_to_sparse_matrix(expected_graph, {0, 3})
+
+    for chunk_size in [1, 4, 100]:
+        info, actual = utils.read_graph_csv_matrices(
+            str(path), start_nodes={0, 3}, chunk_size=chunk_size
+        )
+        assert expected_info.number_of_nodes == info.number_of_nodes
+        assert expected_info.number_of_edges == info.number_of_edges
+        assert expected_info.labels == info.labels
+        assert expected.numerated_states == actual.numerated_states
+        assert expected.start_states == actual.start_states
+        assert expected.final_states == actual.final_states
+        assert expected.matrix.keys() == actual.matrix.keys()
+        for symbol, symbol_matrix in actual.matrix.items():
+            assert 0 == (symbol_matrix != expected.matrix[symbol]).nnz
+
+
+def test_read_mixed_type_graph_csv_matrices(tmp_path) -> None:
+    path = tmp_path / "mixed.csv"
+    path.write_text("1 2 a\n2 x b\nx 1 a\n1 x a\n")
+    expected = automaton_utils.graph_to_sparse_matrix(cd.graph_from_csv(path))
+
+    for chunk_size in [1, 2, 100]:
+        info, actual = utils.read_graph_csv_matrices(str(path), chunk_size=chunk_size)
+        assert 3 == info.number_of_nodes and 4 == info.number_of_edges
+        assert expected.numerated_states == actual.numerated_states
+        assert expected.matrix.keys() == actual.matrix.keys()
+        for symbol, symbol_matrix in actual.matrix.items():
+            assert 0 == (symbol_matrix != expected.matrix[symbol]).nnz
+
+
+def test_read_empty_graph_csv_matrices(tmp_path) -> None:
+    path = tmp_path / "empty.csv"
+    path.write_text("")
+    info, actual = utils.read_graph_csv_matrices(str(path))
+    assert 0 == info.number_of_nodes and 0 == info.number_of_edges
+    assert {} == actual.matrix
@@ -0,0 +1,52 @@
+import random
+import networkx as nx
+import project.automaton_utils as automaton_utils
+import project.graph_utils as graph_utils
+import pytest
+from project.incremental_rpq import MaterializedRpq
+
+
+def test_materialized_rpq_initial_result() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(6, 4, labels=("a", "b"))
+    query = MaterializedRpq(graph, "a* b", start_states={0, 2})
+    assert automaton_utils.rpq(graph, "a* b", {0, 2}) == query.result()
+
+
+@pytest.mark.parametrize(
+    "regex, start_states, final_states",
+    [("a* b", None, None), ("(a b)* c", {0, 1, 2}, None), ("a+b c*", None, {3, 4})],
+)
+def test_materialized_rpq_under_updates(regex, start_states, final_states) -> None:
+    rng = random.Random(42)
+    graph = nx.MultiDiGraph()
+    graph.add_nodes_from(range(4))
+    query = MaterializedRpq(graph, regex, start_states, final_states)
+    edges = []
+
+    for _ in range(120):
+        if edges and rng.random() < 0.4:
+            edge = edges.pop(rng.randrange(len(edges)))
+            query.remove_edge(*edge)
+            node_from, label, node_to = edge
+            key = next(
+                k
+                for k, data in graph[node_from][node_to].items()
+                if data["label"] == label
+            )
+            graph.remove_edge(node_from, node_to, key)
+        else:
+            edge = (rng.randrange(8), rng.choice("abc"), rng.randrange(8))
+            edges.append(edge)
+            query.add_edge(*edge)
+            graph.add_edge(edge[0], edge[2], label=edge[1])
+
+        assert (
+            automaton_utils.rpq(graph, regex, start_states, final_states)
+            == query.result()
+        )
+
+
+def test_remove_missing_edge() -> None:
+    query = MaterializedRpq(nx.MultiDiGraph(), "a")
+    with pytest.raises(KeyError):
+        query.remove_edge(0, "a", 1)
@@ -0,0 +1,71 @@
+import project.automaton_utils as automaton_utils
+import project.graph_utils as graph_utils
+import project.matrix_backend as matrix_backend
+import project.sparse_matrix_utils as sparse_matrix_utils
+import pytest
+from pyformlang.regular_expression import Regex
+
+
+@pytest.mark.parametrize("backend", list(matrix_backend.BACKENDS))
+def test_rpq_with_every_backend(backend) -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(7, 4, labels=("a", "b"))
+    regexes = [Regex("a*b"), Regex("(a+b)*b a"), Regex("c")]
+    expected = [
+        (
+            automaton_utils.rpq(graph, regex),
+            automaton_utils.bfs_rpq(graph, regex, start_states={0, 9}),
+            automaton_utils.bfs_rpq(graph, regex, foreach_start_node=True),
+        )
+        for regex in regexes
+    ]
+
+    def regex_matrix_types() -> set:
+        return {
+            type(m)
+            for m in automaton_utils.compile_regex(
+                regexes[0]
+            ).sparse_matrix.matrix.values()
+        }
+
+    with matrix_backend.use_backend(backend) as current:
+        assert {type(current.zeros((1, 1)))} == regex_matrix_types()
+        for regex, (rpq, bfs, foreach_bfs) in zip(regexes, expected):
+            assert rpq == automaton_utils.rpq(graph, regex)
+            assert bfs == automaton_utils.bfs_rpq(graph, regex, start_states={0, 9})
+            assert foreach_bfs == automaton_utils.bfs_rpq(
+                graph, regex, foreach_start_node=True
+            )
+    assert "csr" == matrix_backend.get_backend().name
+    assert {type(matrix_backend.get_backend().zeros((1, 1)))} == regex_matrix_types()
+
+
+def test_backend_operations_agree() -> None:
+    rows, cols = [0, 1, 2], [1, 2, 0]
+    dense_backend = matrix_backend.BACKENDS["dense"]
+    expected = dense_backend.from_coo([0, 1, 2], [2, 0, 1], (3, 3))
+    for name, backend in matrix_backend.BACKENDS.items():
+        matrix = backend.from_coo(rows, cols, (3, 3))
+        product = backend.matmul(matrix, backend.add(matrix, backend.zeros((3, 3))))
+
+        assert (expected == dense_backend.convert(product)).all(), name
+        assert 9 == backend.nnz(backend.kron(matrix, matrix)), name
+        assert 6 == backend.nnz(backend.block_diag([matrix, matrix])), name
+        assert (6, 3) == backend.vstack([matrix, matrix]).shape, name
+
+
+def test_compare_backends() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(10, 10, labels=("a", "b"))
+    report = sparse_matrix_utils.compare_backends(
+        automaton_utils.graph_to_sparse_matrix(graph),
+        automaton_utils.compile_regex("a* b").sparse_matrix,
+        backends=["csr", "dense", "packed"],
+    )
+
+    assert {"dok", "csr", "dense", "packed"} == report.keys()
+    assert 1.0 == report["dok"]["speedup"]
+    assert all(0 < entry["time"] for entry in report.values())
+
+
+def test_unknown_backend() -> None:
+    with pytest.raises(ValueError):
+        matrix_backend.set_backend("unknown")
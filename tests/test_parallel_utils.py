@@ -0,0 +1,62 @@
+import numpy as np
+import project.automaton_utils as automaton_utils
+import project.graph_utils as graph_utils
+import project.parallel_utils as parallel_utils
+import project.sparse_matrix_utils as sparse_matrix_utils
+import pytest
+from pyformlang.regular_expression import Regex
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_parallel_bfs_rpq_matches_serial(executor) -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(20, 15, labels=("a", "b"))
+    for regex in [Regex("a*b"), Regex("(a+b)*b b")]:
+        for foreach_start_node in [True, False]:
+            expected = automaton_utils.bfs_rpq(
+                graph, regex, foreach_start_node=foreach_start_node
+            )
+            assert expected == automaton_utils.bfs_rpq(
+                graph,
+                regex,
+                foreach_start_node=foreach_start_node,
+                executor=executor,
+                workers=3,
+            )
+
+
+def test_share_and_attach_matrices() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(5, 5, labels=("a", "b"))
+    matrix = automaton_utils.graph_to_sparse_matrix(graph).matrix
+    blocks, layout = parallel_utils.share_matrices(matrix)
+    try:
+        attached_blocks, attached = parallel_utils.attach_matrices(layout)
+        assert matrix.keys() == attached.keys()
+        for symbol in matrix:
+            assert 0 == (matrix[symbol] != attached[symbol]).nnz
+
+        # Workers keep the shared graph blocks instead of copying them.
+        graph_smatrix = automaton_utils.graph_to_sparse_matrix(graph)._replace(
+            matrix=attached
+        )
+        regex_smatrix = automaton_utils.compile_regex("a* b").sparse_matrix
+        direct_sum = sparse_matrix_utils.direct_sum_matrices(
+            graph_smatrix, regex_smatrix, split=True
+        )
+        for symbol, ds_matrix in direct_sum.items():
+            assert np.shares_memory(ds_matrix.graph.indices, attached[symbol].indices)
+        assert sparse_matrix_utils.bfs(
+            graph_smatrix, regex_smatrix, True, direct_sum
+        ) == sparse_matrix_utils.bfs(graph_smatrix, regex_smatrix, True)
+        del graph_smatrix, direct_sum, attached
+        for block in attached_blocks:
+            block.close()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def test_split_start_states() -> None:
+    chunks = parallel_utils.split_start_states(set(range(10)), 4)
+    assert 4 == len(chunks)
+    assert set(range(10)) == {state for chunk in chunks for state in chunk}
@@ -0,0 +1,45 @@
+import numpy as np
+import project.automaton_utils as automaton_utils
+import project.graph_utils as graph_utils
+import project.profiling as profiling
+from scipy.sparse import csr_matrix
+
+
+def test_profile_rpq_phases() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(4, 3, labels=("a", "b"))
+    automaton_utils.regex_cache.clear()
+    seen = []
+    with profiling.profile(seen.append) as profile:
+        automaton_utils.rpq(graph, "a* b")
+    names = [record.name for record in profile.records]
+    assert names == [
+        "regex_to_min_dfa",
+        "nfa_to_sparse_matrix",
+        "graph_to_matrix",
+        "prune",
+        "intersect",
+        "closure",
+        "decode",
+    ]
+    assert seen == profile.records
+    closure = profile.records[names.index("closure")]
+    assert closure.iterations == len(closure.nnz) > 0
+    assert closure.nnz == sorted(closure.nnz) and closure.matrix_bytes > 0
+    assert set(profile.totals()) == set(names)
+
+
+def test_profile_bfs_phases() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(4, 3, labels=("a", "b"))
+    with profiling.profile() as profile:
+        automaton_utils.bfs_rpq(graph, "a* b", {0}, None, True)
+    names = {record.name for record in profile.records}
+    assert {"bfs_front", "bfs_traversal", "decode"} <= names
+
+
+def test_profiling_disabled() -> None:
+    with profiling.phase("closure") as timer:
+        timer.iteration(csr_matrix(np.eye(2, dtype=bool)))
+    with profiling.profile() as profile:
+        pass
+    assert profile.records == []
+    assert profiling.matrix_nbytes(np.zeros((2, 4), dtype=bool)) == 8
@@ -0,0 +1,59 @@
+import numpy as np
+import project.automaton_utils as automaton_utils
+import project.graph_utils as graph_utils
+import pytest
+from project.rpq_result import RpqResult
+
+
+def test_rpq_result_pairs(tmp_path) -> None:
+    nodes = ["a", "b", "c"]
+    result = RpqResult(
+        dict(enumerate(nodes)),
+        {node: i for i, node in enumerate(nodes)},
+        np.array([2, 1, 2]),
+        np.array([0, 0, 0]),
+    )
+    assert len(result) == 2
+    assert set(result) == {("a", "b"), ("a", "c")}
+    assert ("a", "c") in result and ("c", "a") not in result
+    assert ("a", "x") not in result
+    assert result == {("a", "b"), ("a", "c")}
+
+    starts, ends = result.to_numpy(mapped=False)
+    assert starts.tolist() == [0, 0] and ends.tolist() == [1, 2]
+    assert [e.tolist() for e in result.to_numpy()] == [["a", "a"], ["b", "c"]]
+
+    result.to_csv(tmp_path / "result.csv")
+    assert (tmp_path / "result.csv").read_text() == "a b\na c\n"
+
+
+def test_rpq_result_vertices() -> None:
+    result = RpqResult({0: "x", 1: "y"}, {"x": 0, "y": 1}, [1, 1])
+    assert list(result) == ["y"] and "y" in result and "x" not in result
+
+
+@pytest.mark.parametrize(
+    "regex, start_states, final_states",
+    [("a* b", None, None), ("a b*", {0, 1}, {2, 3, 4})],
+)
+def test_lazy_result_matches_sets(regex, start_states, final_states) -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(5, 3, labels=("a", "b"))
+    assert automaton_utils.rpq(
+        graph, regex, start_states, final_states, lazy_result=True
+    ) == automaton_utils.rpq(graph, regex, start_states, final_states)
+    for foreach_start_node in (False, True):
+        for executor in ("serial", "thread"):
+            lazy = automaton_utils.bfs_rpq(
+                graph,
+                regex,
+                start_states,
+                final_states,
+                foreach_start_node,
+                executor,
+                workers=2,
+                lazy_result=True,
+            )
+            assert isinstance(lazy, RpqResult)
+            assert lazy == automaton_utils.bfs_rpq(
+                graph, regex, start_states, final_states, foreach_start_node
+            )
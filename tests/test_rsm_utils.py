@@ -0,0 +1,22 @@
+import project.rsm_utils as rsm_utils
+from pyformlang.cfg import Variable
+
+
+def test_ecfg_from_text() -> None:
+    ecfg = rsm_utils.ecfg_from_text("S -> a S b | $\nA -> a*\nA -> b")
+    assert ecfg.start_symbol == Variable("S")
+    assert set(ecfg.productions) == {Variable("S"), Variable("A")}
+    box = ecfg.productions[Variable("A")].to_epsilon_nfa()
+    assert box.accepts("aa") and box.accepts("b") and not box.accepts("ab")
+
+
+def test_cfg_to_rsm() -> None:
+    rsm = rsm_utils.as_rsm(rsm_utils.cfg_utils.as_cfg("S -> a S b | a b"))
+    assert rsm.boxes[Variable("S")].accepts(["a", "S", "b"])
+    assert not rsm.boxes[Variable("S")].accepts(["a", "S"])
+
+    rsm_matrix = rsm_utils.rsm_to_sparse_matrix(rsm)
+    assert rsm_matrix.nonterminals == ["S"]
+    assert set(rsm_matrix.sparse_matrix.matrix) == {"a", "b", "S"}
+    assert rsm_matrix.start_mask.sum() == 1 and rsm_matrix.final_mask.sum() == 1
+    assert (rsm_matrix.box_of_state == 0).all()
@@ -1,7 +1,11 @@
+import numpy as np
 import project.automaton_utils as automaton_utils
+import project.graph_utils as graph_utils
 import project.sparse_matrix_utils as sparse_matrix_utils
+import pytest
 from pyformlang.finite_automaton import DeterministicFiniteAutomaton as DFA, State
 from pyformlang.regular_expression import Regex
+from scipy.sparse import csr_matrix
 
 
 def test_intersect() -> None:
@@ -178,3 +182,211 @@ def test_intersect_with_one_state_automaton() -> None:
     )
 
     assert empty_automaton.is_equivalent_to(automaton_trans)
+
+
+def test_nfa_to_sparse_matrix_builds_csr_per_symbol() -> None:
+    state0 = State(0)
+    state1 = State(1)
+    automaton = DFA()
+    automaton.add_start_state(state0)
+    automaton.add_final_state(state1)
+    automaton.add_transitions(
+        [(state0, "a", state1), (state1, "a", state0), (state1, "b", state1)]
+    )
+    sparse_matrix = sparse_matrix_utils.nfa_to_sparse_matrix(automaton)
+    numbers = sparse_matrix.numerated_states
+
+    assert {"a", "b"} == set(sparse_matrix.matrix.keys())
+    for symbol, symbol_matrix in sparse_matrix.matrix.items():
+        assert "csr" == symbol_matrix.format
+        assert bool == symbol_matrix.dtype
+    assert {
+        (numbers[state0], numbers[state1]),
+        (numbers[state1], numbers[state0]),
+    } == set(zip(*sparse_matrix.matrix["a"].nonzero()))
+    assert {(numbers[state1], numbers[state1])} == set(
+        zip(*sparse_matrix.matrix["b"].nonzero())
+    )
+
+
+def test_nfa_to_sparse_matrix_skips_epsilon() -> None:
+    enfa = Regex("a* b").to_epsilon_nfa()
+    sparse_matrix = sparse_matrix_utils.nfa_to_sparse_matrix(enfa)
+    assert set(sparse_matrix.matrix.keys()) == set(enfa.symbols)
+    assert all(m.nnz > 0 for m in sparse_matrix.matrix.values())
+
+    graph = graph_utils.get_labeled_two_cycles_graph(2, 2, labels=("a", "epsilon"))
+    nfa = automaton_utils.graph_to_nfa(graph, is_epsilon_forbidden=False)
+    sparse_matrix = sparse_matrix_utils.nfa_to_sparse_matrix(nfa)
+    assert set(sparse_matrix.matrix.keys()) == set(nfa.symbols)
+
+
+def test_transitive_closure() -> None:
+    # Chain 0 -> 1 -> 2 -> 3 and a loop 4 -> 4.
+    matrix = csr_matrix(
+        ([True] * 4, ([0, 1, 2, 4], [1, 2, 3, 4])), shape=(5, 5), dtype=bool
+    )
+    expected = {(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3), (4, 4)}
+
+    for matrix_format in ["csr", "csc", "dok"]:
+        closure = sparse_matrix_utils.transitive_closure(matrix.asformat(matrix_format))
+        assert expected == set(zip(*closure.nonzero()))
+    assert "csc" == sparse_matrix_utils.transitive_closure(matrix.tocsc()).format
+
+
+def test_upd_front() -> None:
+    regex_smatrix = sparse_matrix_utils.SparseMatrix(
+        {State(0): 0, State(1): 1}, {0: State(0), 1: State(1)}, set(), set(), {}
+    )
+    # Two blocks of two rows: regex part of width 2, graph part of width 3.
+    front = csr_matrix(
+        [
+            [0, 1, 1, 0, 0],
+            [1, 0, 0, 0, 1],
+            [1, 1, 0, 0, 0],
+            [1, 0, 0, 1, 0],
+        ],
+        dtype=bool,
+    )
+    expected = [
+        [1, 0, 0, 0, 1],
+        [0, 1, 1, 0, 0],
+        [1, 0, 0, 1, 0],
+        [0, 0, 0, 0, 0],
+    ]
+
+    assert (
+        expected
+        == (
+            sparse_matrix_utils.upd_front(regex_smatrix, front).toarray().astype(int)
+        ).tolist()
+    )
+
+
+def test_compact_intersect_matches_intersect() -> None:
+    sparse_matrix1 = sparse_matrix_utils.nfa_to_sparse_matrix(
+        automaton_utils.regex_to_min_dfa(Regex("(a b)* c"))
+    )
+    sparse_matrix2 = sparse_matrix_utils.nfa_to_sparse_matrix(
+        automaton_utils.regex_to_min_dfa(Regex("a* (b+c)*"))
+    )
+    expected = sparse_matrix_utils.intersect(sparse_matrix1, sparse_matrix2)
+    compact1 = sparse_matrix_utils.to_compact(sparse_matrix1)
+    compact2 = sparse_matrix_utils.to_compact(sparse_matrix2)
+    actual = sparse_matrix_utils.compact_intersect(compact1, compact2)
+
+    assert actual.states is None
+    assert expected.start_states == set(np.flatnonzero(actual.start_mask))
+    assert expected.final_states == set(np.flatnonzero(actual.final_mask))
+    assert set(expected.matrix.keys()) == set(actual.symbols)
+    for i, symbol in enumerate(actual.symbols):
+        assert 0 == (actual.matrix[i] != expected.matrix[symbol]).nnz
+
+    left, right = sparse_matrix_utils.split_product_states(
+        np.arange(len(actual.final_mask)), len(compact2.final_mask)
+    )
+    assert (
+        actual.final_mask == (compact1.final_mask[left] & compact2.final_mask[right])
+    ).all()
+
+
+def test_compact_round_trip() -> None:
+    sparse_matrix = sparse_matrix_utils.nfa_to_sparse_matrix(
+        automaton_utils.regex_to_min_dfa(Regex("(a+b+$)*c"))
+    )
+    restored = sparse_matrix_utils.from_compact(
+        sparse_matrix_utils.to_compact(sparse_matrix)
+    )
+
+    assert sparse_matrix_utils.sparse_matrix_to_nfa(restored).is_equivalent_to(
+        sparse_matrix_utils.sparse_matrix_to_nfa(sparse_matrix)
+    )
+
+
+def test_bfs_witnesses() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+    graph_smatrix = automaton_utils.graph_to_sparse_matrix(graph, {1}, None)
+    regex_smatrix = automaton_utils.compile_regex("a* b").sparse_matrix
+
+    ans, witnesses = sparse_matrix_utils.bfs(
+        graph_smatrix, regex_smatrix, foreach_start_node=True, witnesses=True
+    )
+    assert ans == sparse_matrix_utils.bfs(graph_smatrix, regex_smatrix, True)
+    assert witnesses.path(4, 1) == [(1, "a", 2), (2, "a", 3), (3, "a", 0), (0, "b", 4)]
+    # Only the reached cells of the |Q| x |V| product are stored.
+    assert 0 < len(witnesses.keys) < len(regex_smatrix.numerated_states) * 6
+    assert witnesses.nbytes == 20 * len(witnesses.keys)
+    with pytest.raises(KeyError):
+        witnesses.path(2, 1)
+
+
+def test_transitive_closure_with_delta() -> None:
+    matrix = csr_matrix(np.eye(4, k=1, dtype=bool))
+    closure = sparse_matrix_utils.transitive_closure(matrix)
+    delta = csr_matrix(([True], ([3], [0])), shape=(4, 4), dtype=bool)
+    assert (
+        sparse_matrix_utils.transitive_closure(closure, delta)
+        != sparse_matrix_utils.transitive_closure(matrix + delta)
+    ).nnz == 0
+
+
+def test_prune_states() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+    graph.add_edge(6, 0, label="a")
+    graph_smatrix = automaton_utils.graph_to_sparse_matrix(graph, {1}, {4}, {"a"})
+    assert set(graph_smatrix.matrix) == {"a"}
+    assert sparse_matrix_utils.prune_states(graph_smatrix).numerated_states == {}
+
+    graph_smatrix = automaton_utils.graph_to_sparse_matrix(graph, {1}, {3})
+    pruned = sparse_matrix_utils.prune_states(graph_smatrix)
+    assert set(pruned.numerated_states) == {0, 1, 2, 3, 4, 5}
+    assert pruned.start_states == {1} and pruned.final_states == {3}
+    assert pruned.matrix["a"].nnz == 4 and pruned.matrix["b"].nnz == 3
+
+
+def test_reverse_and_bidirectional_bfs() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(4, 3, labels=("a", "b"))
+    regex_smatrix = automaton_utils.compile_regex("a* b b*").sparse_matrix
+    for start_states, final_states in [(None, None), ({1, 2}, {5, 0}), ({3}, set())]:
+        graph_smatrix = automaton_utils.graph_to_sparse_matrix(
+            graph, start_states, final_states
+        )
+        for foreach_start_node in (False, True):
+            expected = sparse_matrix_utils.bfs(
+                graph_smatrix, regex_smatrix, foreach_start_node
+            )
+            assert expected == sparse_matrix_utils.reverse_bfs(
+                graph_smatrix, regex_smatrix, foreach_start_node
+            )
+            assert expected == sparse_matrix_utils.bidirectional_bfs(
+                graph_smatrix, regex_smatrix, foreach_start_node
+            )
+
+
+def test_plan_direction() -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(40, 30, labels=("a", "b"))
+    regex_smatrix = automaton_utils.compile_regex("a* b").sparse_matrix
+    few_finals = automaton_utils.graph_to_sparse_matrix(graph, None, {5})
+    plan = sparse_matrix_utils.plan_direction(few_finals, regex_smatrix, True)
+    assert plan.direction == "reverse"
+    assert set(plan.log_costs) == set(sparse_matrix_utils.DIRECTIONS)
+    few_starts = automaton_utils.graph_to_sparse_matrix(graph, {5}, None)
+    assert (
+        sparse_matrix_utils.plan_direction(few_starts, regex_smatrix, True).direction
+        == "forward"
+    )
+
+    # A multi-source forward search is one row however many starts there are.
+    many_finals = automaton_utils.graph_to_sparse_matrix(graph, None, set(range(30)))
+    for regex in ["(a | b)* b", "a (a | b)*"]:
+        regex_smatrix = automaton_utils.compile_regex(regex).sparse_matrix
+        assert (
+            sparse_matrix_utils.plan_direction(many_finals, regex_smatrix).direction
+            == "forward"
+        )
+        assert (
+            sparse_matrix_utils.plan_direction(
+                many_finals, regex_smatrix, True
+            ).direction
+            != "forward"
+        )
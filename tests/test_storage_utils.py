@@ -0,0 +1,86 @@
+import networkx as nx
+import numpy as np
+import project.automaton_utils as automaton_utils
+import project.graph_utils as graph_utils
+import project.sparse_matrix_utils as sparse_matrix_utils
+import project.storage_utils as storage_utils
+import pytest
+
+
+def is_memory_mapped(array: np.ndarray) -> bool:
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+def test_save_and_load_sparse_matrix(tmp_path) -> None:
+    graph = graph_utils.get_labeled_two_cycles_graph(10, 5, labels=("a", "b"))
+    sparse_matrix = automaton_utils.graph_to_sparse_matrix(
+        graph, start_nodes={0, 3}, final_nodes={1, 2, 12}
+    )
+    storage_utils.save_sparse_matrix(sparse_matrix, str(tmp_path))
+    loaded = storage_utils.load_sparse_matrix(str(tmp_path))
+
+    assert {0, 3} == set(loaded.start_states)
+    assert {1, 2, 12} == set(loaded.final_states)
+    assert dict(sparse_matrix.numerated_states) == dict(loaded.numerated_states)
+    assert dict(sparse_matrix.inversed_numerated_states) == dict(
+        loaded.inversed_numerated_states
+    )
+    assert sparse_matrix.matrix.keys() == loaded.matrix.keys()
+    for symbol, symbol_matrix in loaded.matrix.items():
+        assert is_memory_mapped(symbol_matrix.indices)
+        assert 0 == (symbol_matrix != sparse_matrix.matrix[symbol]).nnz
+
+    regex_smatrix = automaton_utils.compile_regex("a* b").sparse_matrix
+    assert sparse_matrix_utils.bfs(
+        sparse_matrix, regex_smatrix, foreach_start_node=True
+    ) == sparse_matrix_utils.bfs(loaded, regex_smatrix, foreach_start_node=True)
+
+
+def test_lazy_numeration_is_built_on_access() -> None:
+    calls = []
+    mapping = storage_utils.LazyMapping(lambda: calls.append(1) or {"x": 0}, 1)
+
+    assert 1 == len(mapping) and [] == calls
+    assert 0 == mapping["x"] and [1] == calls
+
+
+def test_save_and_load_object_nodes(tmp_path) -> None:
+    graph = graph_utils.read_graph_dot("tests/output/task_1/some_graph.dot")
+    sparse_matrix = automaton_utils.graph_to_sparse_matrix(graph)
+    storage_utils.save_sparse_matrix(sparse_matrix, str(tmp_path))
+    loaded = storage_utils.load_sparse_matrix(str(tmp_path), mmap=False)
+
+    assert set(sparse_matrix.start_states) == set(loaded.start_states)
+    assert dict(sparse_matrix.numerated_states) == dict(loaded.numerated_states)
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_and_load_mixed_type_nodes(tmp_path, mmap) -> None:
+    graph = nx.MultiDiGraph()
+    graph.add_edge(1, "x", label="a")
+    graph.add_edge("x", 2, label="b")
+    sparse_matrix = automaton_utils.graph_to_sparse_matrix(graph, {1}, {2})
+    storage_utils.save_sparse_matrix(sparse_matrix, str(tmp_path))
+    loaded = storage_utils.load_sparse_matrix(str(tmp_path), mmap=mmap)
+
+    assert dict(sparse_matrix.numerated_states) == dict(loaded.numerated_states)
+    assert {1} == set(loaded.start_states) and {2} == set(loaded.final_states)
+    regex_smatrix = automaton_utils.compile_regex("a b").sparse_matrix
+    assert {(1, 2)} == sparse_matrix_utils.bfs(loaded, regex_smatrix, True)
+
+
+def test_save_and_load_non_string_labels(tmp_path) -> None:
+    graph = nx.MultiDiGraph()
+    graph.add_edge(0, 1, label=1)
+    graph.add_edge(1, 2, label="a")
+    sparse_matrix = automaton_utils.graph_to_sparse_matrix(graph)
+    storage_utils.save_sparse_matrix(sparse_matrix, str(tmp_path))
+    loaded = storage_utils.load_sparse_matrix(str(tmp_path))
+
+    assert sparse_matrix.matrix.keys() == loaded.matrix.keys()
+    for symbol, symbol_matrix in sparse_matrix.matrix.items():
+        assert 0 == (symbol_matrix != loaded.matrix[symbol]).nnz